@@ -0,0 +1,99 @@
+'''
+Render the rolling circle frames for several circle_segments across a process pool.
+
+script.py draws one value of circle_segments into figure_directory, both set
+at the top of the file.  render_sweep writes the frames of any number of
+values at once: each value gets a directory <circle_segments>_segments with
+fig1.png ... fig<circle_segments+1>.png and final.png, the same files as
+script.py.
+
+Frames are split into chunks of consecutive frames.  A chunk starts from
+rolling_circle.frame_geometry of its first frame, so chunks do not depend on
+each other and run on as many worker processes as there are cores.  Each
+worker switches to the Agg backend and draws its chunk with
+rolling_circle_frames, which blits the frames after the first.
+
+Example:
+    import render_frames
+
+    render_frames.render_sweep([6,12,360],'figures')
+
+To run:
+    python render_frames.py 6 12 360 1000 figures --processes 4
+'''
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def frame_directory(outdir,circle_segments):
+    return os.path.join(outdir,'{}_segments'.format(circle_segments))
+
+
+def render_sweep(segments,outdir,dpi=72,processes=None,chunksize=None):
+    '''Write the rolling circle frames of every circle_segments in segments
+
+    Inputs:
+        segments -- list of circle_segments values
+        outdir -- output directory, files are <n>_segments/fig<k>.png and final.png
+        dpi -- resolution; the figure is 12 x 6 inches
+        processes -- number of worker processes (None for one per core,
+                     1 to render in this process)
+        chunksize -- frames per job (default: the frames split into four
+                     jobs per worker)
+
+    Returns:
+        list of the files written
+    '''
+    nframes = sum(n+2 for n in segments)
+    if chunksize is None:
+        chunksize = max(1,-(-nframes//(4*(processes or os.cpu_count() or 1))))
+
+    jobs = []
+    for n in segments:
+        os.makedirs(frame_directory(outdir,n),exist_ok=True)
+        jobs += [(n,start,min(start+chunksize,n+2),outdir,dpi) for start in range(0,n+2,chunksize)]
+
+    if processes==1:
+        _init_worker()
+        paths = [_render(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes,initializer=_init_worker) as pool:
+            paths = list(pool.map(_render,jobs))
+    return [p for job_paths in paths for p in job_paths]
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(job):
+    from PIL import Image
+    from rolling_circle import rolling_circle_frames
+
+    circle_segments,start,stop,outdir,dpi = job
+    paths = []
+    for name,frame in rolling_circle_frames(circle_segments,dpi=dpi,start=start,stop=stop):
+        path = os.path.join(frame_directory(outdir,circle_segments),name+'.png')
+        Image.fromarray(frame).save(path)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('segments',type=int,nargs='+',help='circle_segments values')
+    parser.add_argument('outdir')
+    parser.add_argument('--dpi',type=int,default=72)
+    parser.add_argument('--processes',type=int,default=None)
+    parser.add_argument('--chunksize',type=int,default=None,help='frames per job')
+    args = parser.parse_args()
+
+    paths = render_sweep(args.segments,args.outdir,dpi=args.dpi,processes=args.processes,chunksize=args.chunksize)
+    print('Wrote {} files to {}'.format(len(paths),args.outdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+'''
+Roll a circle of diameter 1 along the x axis to measure pi.
+
+The circle is split into circle_segments arcs.  At each step the circle rolls
+one chord length to the right and leaves one arc lying on the x axis, with a
+marker at each point where it touched.  Once the circle is used up, the
+markers span circle_segments chords, which approaches pi as the number of
+segments grows.
+
+script.py draws each step by moving the patches and saving the whole figure.
+animate() draws the same frames with blitting: the axes from create_axes are
+rendered once and cached as the background, arcs that have been laid down
+are drawn into that background once, and each frame only draws the rolling
+circle and the markers over it.  Frames go straight from the Agg buffer to a
+GIF (Pillow) or an MP4 (raw video piped to ffmpeg), with no PNG files.
+
+To run:
+    python rolling_circle.py 12 figures/twelve_segments.gif
+    python rolling_circle.py 1000 figures/1000_segments.mp4 --fps 60
+'''
+
+import argparse
+import os
+import shutil
+import subprocess
+from decimal import Decimal
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.patches import Arc
+
+
+XLIM = (-2,4)
+YLIM = (-1,2)
+CIRCLE_COLOR = 'blue'
+CIRCLE_LINEWIDTH = 6
+
+# GIF frame times: the first and last frame are held, the steps share STEPS_MS
+FIRST_MS = 2000
+LAST_MS = 3000
+STEPS_MS = 2400
+MIN_FRAME_MS = 20
+
+
+def create_axes(xlim,ylim):
+    fig,ax = plt.subplots(figsize=(2*np.diff(xlim)[0],2*np.diff(ylim)[0]))
+
+    # Setup Axes
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    plt.arrow(0,0,xlim[1]-.5,0,width=.02,fc='gray')
+    plt.arrow(0,0,xlim[0]+.5,0,width=.02,fc='gray')
+    plt.arrow(0,0,0,ylim[1]-.5,width=.02,fc='gray')
+    plt.arrow(0,0,0,ylim[0]+.5,width=.02,fc='gray')
+
+    # Eliminate upper and right axes
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['bottom'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+
+    # Show ticks on the left and lower axes only
+    ax.xaxis.set_tick_params(bottom='on', top='off',labelsize=28)
+    ax.yaxis.set_tick_params(left='on', right='off',labelsize=28)
+
+    # Move remaining spines to the center
+    ax.spines['bottom'].set_position('zero') # spine for xaxis
+    #    - will pass through the center of the y-values (which is 0)
+    ax.spines['left'].set_position('zero')  # spine for yaxis
+    #    - will pass through the center of the x-values (which is 5)
+
+    plt.text(xlim[1]-.75,.25,"x",fontsize=28)
+    plt.text(.25,ylim[1]-.5,"y",fontsize=28)
+
+    return fig,ax
+
+
+def calc_chord_length(radius,angle):
+    return radius*2*np.sin(angle/2)
+
+
+def annotation_text(chordsum):
+    '''chordsum cut to six digits, e.g. 3.10582..., as in script.py'''
+    digits = Decimal(chordsum).as_tuple().digits
+    if len(digits)>6:
+        return str(digits[0]) + '.' + ''.join([str(x) for x in digits[1:6]]) + '...'
+    return str(chordsum)
+
+
+def frame_geometry(circle_segments,k):
+    '''Geometry of frame k of the rolling circle, without the frames before it
+
+    Frame 0 is fig1, the circle at rest; frame 1 is fig2, rolled one
+    segment along; frames 2 to circle_segments have left k-1 arcs on the
+    x axis; frame circle_segments+1 is final, the last frame annotated with
+    the sum of the chords.
+
+    Inputs:
+        circle_segments -- number of arcs the circle is split into
+        k -- frame number, 0 to circle_segments+1
+
+    Returns:
+        dict with
+            name -- fig<k+1> or final, as in script.py
+            center -- (x,y) of the rolling circle
+            theta1, theta2 -- angles in degrees of what is left of the circle
+            arc_centers -- array of the centers of the arcs on the x axis
+            arc_theta -- (theta1,theta2) of every arc on the x axis
+            markers -- x of the points where the circle touched the x axis
+            chordsum -- the sum of the chords for final, else None
+    '''
+    if not 0<=k<=circle_segments+1:
+        raise ValueError('frame {} of {} segments'.format(k,circle_segments))
+    segment_angle_deg = 360/circle_segments
+    segment_angle_rad = 2*np.pi/circle_segments
+    chord_length = calc_chord_length(.5,segment_angle_rad)
+    height = .5*np.cos(segment_angle_rad/2)
+
+    # Arcs left on the x axis, and how far the circle has rolled past fig2
+    nrolls = min(max(k-1,0),circle_segments-1)
+    arc_centers = np.column_stack([chord_length*(.5+np.arange(nrolls)),np.full(nrolls,height)])
+    if k==0:
+        center,markers = (0,.5),np.array([])
+    else:
+        center,markers = (chord_length*(.5+nrolls),height),chord_length*np.arange(nrolls+2)
+    if k<2:
+        theta1,theta2 = 0,360
+    else:
+        theta1 = 270-segment_angle_deg/2
+        theta2 = theta1-nrolls*segment_angle_deg
+
+    final = k==circle_segments+1
+    return {'name':'final' if final else 'fig{}'.format(k+1),
+            'center':center,
+            'theta1':theta1,
+            'theta2':theta2,
+            'arc_centers':arc_centers,
+            'arc_theta':(270-segment_angle_deg/2,270+segment_angle_deg/2),
+            'markers':markers,
+            'chordsum':circle_segments*chord_length if final else None}
+
+
+def rolling_circle_frames(circle_segments,dpi=72,start=0,stop=None):
+    '''Render the rolling circle frames with blitting
+
+    Inputs:
+        circle_segments -- number of arcs the circle is split into
+        dpi -- resolution; the figure is 12 x 6 inches
+        start, stop -- range of frame numbers of frame_geometry, default all
+                       circle_segments+2 frames
+
+    Yields:
+        (name, frame) with name fig1, ..., fig<circle_segments+1>, final as
+        in script.py, and frame an RGBA array of the Agg buffer.  The buffer
+        is reused, so copy a frame to keep it.
+    '''
+    if stop is None:
+        stop = circle_segments+2
+    fig,ax = create_axes(XLIM,YLIM)
+    ax.set_xticks([-1,1,2,3])
+    ax.set_yticks([])
+    fig.set_dpi(dpi)
+    canvas = FigureCanvasAgg(fig)
+
+    circle = Arc((0,.5),1,1,edgecolor=CIRCLE_COLOR,linewidth=CIRCLE_LINEWIDTH,animated=True)
+    ax.add_patch(circle)
+    markers = ax.plot([],[],'.',color='yellow',markersize=15,animated=True)[0]
+
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    narcs = 0
+
+    try:
+        for k in range(start,stop):
+            geometry = frame_geometry(circle_segments,k)
+
+            # Arcs stay put once they are on the x axis, so draw them into the background once
+            if len(geometry['arc_centers'])>narcs:
+                canvas.restore_region(background)
+                for center in geometry['arc_centers'][narcs:]:
+                    arc = Arc(center,1,1,theta1=geometry['arc_theta'][0],theta2=geometry['arc_theta'][1],
+                              linewidth=CIRCLE_LINEWIDTH,edgecolor=CIRCLE_COLOR,animated=True)
+                    ax.add_patch(arc)
+                    ax.draw_artist(arc)
+                background = canvas.copy_from_bbox(fig.bbox)
+                narcs = len(geometry['arc_centers'])
+
+            circle.center = geometry['center']
+            circle.theta1,circle.theta2 = geometry['theta1'],geometry['theta2']
+            markers.set_data(geometry['markers'],np.zeros(len(geometry['markers'])))
+            artists = [circle,markers]
+            if geometry['chordsum'] is not None:
+                chordsum = geometry['chordsum']
+                artists.append(ax.annotate(annotation_text(chordsum),xy=(chordsum,0),xytext=(chordsum,.75),ha='center',
+                                           fontsize=24,arrowprops=dict(arrowstyle="->"),animated=True))
+
+            canvas.restore_region(background)
+            for artist in artists:
+                ax.draw_artist(artist)
+            yield (geometry['name'],np.asarray(canvas.buffer_rgba()))
+    finally:
+        plt.close(fig)
+
+
+def write_gif(frames,path,circle_segments,colors=64):
+    '''Write rolling_circle_frames to a GIF with Pillow
+
+    Every frame is mapped to one palette, made from fig1 and fig2 which
+    have all the colors of the animation.  Pillow keeps every frame until
+    the file is written, one byte per pixel, so use a lower dpi or an MP4
+    for thousands of frames.
+    '''
+    from PIL import Image
+
+    frames = iter(frames)
+    first = [next(frames)[1][:,:,:3].copy() for k in range(2)]
+    palette = Image.fromarray(np.concatenate(first)).quantize(colors=colors)
+
+    def to_palette(rgb):
+        return Image.fromarray(rgb).quantize(palette=palette,dither=Image.Dither.NONE)
+
+    images = [to_palette(rgb) for rgb in first]+[to_palette(frame[:,:,:3]) for name,frame in frames]
+    step_ms = max(MIN_FRAME_MS,STEPS_MS//circle_segments)
+    durations = [FIRST_MS]+[step_ms]*(len(images)-2)+[LAST_MS]
+    images[0].save(path,save_all=True,append_images=images[1:],duration=durations,loop=0,optimize=False)
+
+
+def write_mp4(frames,path,fps=30,first_seconds=FIRST_MS/1000,last_seconds=LAST_MS/1000):
+    '''Pipe rolling_circle_frames to ffmpeg as raw RGBA video, H.264 output'''
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError('ffmpeg is needed to write {}'.format(path))
+
+    process = None
+    try:
+        for k,(name,frame) in enumerate(frames):
+            if process is None:
+                height,width = frame.shape[:2]
+                process = subprocess.Popen(
+                    ['ffmpeg','-y','-loglevel','error',
+                     '-f','rawvideo','-pix_fmt','rgba','-s','{}x{}'.format(width,height),'-r',str(fps),'-i','-',
+                     '-vf','pad=ceil(iw/2)*2:ceil(ih/2)*2','-pix_fmt','yuv420p','-vcodec','libx264',path],
+                    stdin=subprocess.PIPE)
+            # Hold the first and last frames
+            repeat = 1
+            if k==0:
+                repeat = max(1,round(first_seconds*fps))
+            elif name=='final':
+                repeat = max(1,round(last_seconds*fps))
+            data = frame.tobytes()
+            for n in range(repeat):
+                process.stdin.write(data)
+    finally:
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+    if process is None:
+        raise ValueError('no frames to write to {}'.format(path))
+    if process.returncode:
+        raise RuntimeError('ffmpeg failed writing {}'.format(path))
+
+
+def animate(circle_segments,path,dpi=72,fps=30):
+    '''Render the rolling circle to a .gif or .mp4 file'''
+    frames = rolling_circle_frames(circle_segments,dpi=dpi)
+    if os.path.splitext(path)[1].lower()=='.gif':
+        write_gif(frames,path,circle_segments)
+    else:
+        write_mp4(frames,path,fps=fps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('circle_segments',type=int)
+    parser.add_argument('path',help='.gif or .mp4 file')
+    parser.add_argument('--dpi',type=int,default=72)
+    parser.add_argument('--fps',type=int,default=30,help='MP4 frame rate')
+    args = parser.parse_args()
+    animate(args.circle_segments,args.path,dpi=args.dpi,fps=args.fps)
+
+
+if __name__ == '__main__':
+    main()
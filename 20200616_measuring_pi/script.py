@@ -4,48 +4,13 @@ import numpy as np
 from matplotlib.patches import Arc
 import os
 
+from perimeter import inscribed
+from rolling_circle import create_axes, calc_chord_length
+
 
 circle_segments=12
 figure_directory = 'figures/twelve_segments'
 
-def create_axes(xlim,ylim):
-    fig,ax = plt.subplots(figsize=(2*np.diff(xlim)[0],2*np.diff(ylim)[0]))
-
-    # Setup Axes
-    ax.set_xlim(xlim)
-    ax.set_ylim(ylim)
-    plt.arrow(0,0,xlim[1]-.5,0,width=.02,fc='gray')
-    plt.arrow(0,0,xlim[0]+.5,0,width=.02,fc='gray')
-    plt.arrow(0,0,0,ylim[1]-.5,width=.02,fc='gray')
-    plt.arrow(0,0,0,ylim[0]+.5,width=.02,fc='gray')
-
-    # Eliminate upper and right axes
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-
-    # Show ticks on the left and lower axes only
-    ax.xaxis.set_tick_params(bottom='on', top='off',labelsize=28)
-    ax.yaxis.set_tick_params(left='on', right='off',labelsize=28)
-
-    # Move remaining spines to the center
-    ax.spines['bottom'].set_position('zero') # spine for xaxis 
-    #    - will pass through the center of the y-values (which is 0)
-    ax.spines['left'].set_position('zero')  # spine for yaxis 
-    #    - will pass through the center of the x-values (which is 5)
-
-    plt.text(xlim[1]-.75,.25,"x",fontsize=28)
-    plt.text(.25,ylim[1]-.5,"y",fontsize=28)
-
-    return fig,ax
-
-
-def calc_chord_length(radius,angle):
-    return radius*2*np.sin(angle/2)
-
-
-
 fig,ax = create_axes((-2,4),(-1,2))
 ax.set_xticks([-1,1,2,3])
 ax.set_yticks([])
@@ -115,10 +80,10 @@ fig.savefig(os.path.join(figure_directory,'final.png'))
 #%%
 # Plot of chord length with circle segments
     
-nsg = [2,3,4,6,12,36]
-chordlen = [chord_length(.5,2*np.pi/n) for n in nsg]
+nsg = np.array([2,3,4,6,12,36])
+chordlen = calc_chord_length(.5,2*np.pi/nsg)
 
-plt.plot(nsg,chordlen,'.',nsg,chordlen*np.array(nsg),'.')
+plt.plot(nsg,chordlen,'.',nsg,inscribed(nsg),'.')
 
 plt.plot([0,36],[np.pi,np.pi],linestyle='--',color='black')
 
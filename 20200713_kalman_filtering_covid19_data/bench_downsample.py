@@ -0,0 +1,55 @@
+'''
+SVG size and render time of plot_figure1-3 with and without downsampling.
+
+To run:
+    python bench_downsample.py
+    python bench_downsample.py --days 20000 --max-points 1000 2000
+'''
+
+import argparse
+import io
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import notebook_helpers as nh
+
+
+def synthetic_estimates(ndays,seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2020-03-20',periods=ndays,freq='D')
+    rate = 200*np.exp(np.cumsum(rng.normal(0,.02,ndays)))
+    z = pd.Series(rng.poisson(rate).astype(float),index=index)
+    return nh.kf(z,10*z.iloc[:60].var(),20,fast=True)[0]
+
+
+def render(plot_figure,estimate_df,**kwargs):
+    t0 = time.perf_counter()
+    fig,ax = plot_figure(estimate_df,**kwargs)
+    buf = io.BytesIO()
+    fig.savefig(buf,format='svg')
+    plt.close(fig)
+    return (len(buf.getvalue()),time.perf_counter()-t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days',type=int,nargs='+',default=[1000,10000])
+    parser.add_argument('--max-points',type=int,nargs='+',default=[500,2000])
+    args = parser.parse_args()
+
+    print('{:>8} {:>14} {:>12} {:>10} {:>10}'.format('days','figure','max_points','SVG (kB)','time (s)'))
+    for ndays in args.days:
+        estimate_df = synthetic_estimates(ndays)
+        for name,plot_figure in [('plot_figure1',nh.plot_figure1),('plot_figure2',nh.plot_figure2),('plot_figure3',nh.plot_figure3)]:
+            for max_points in [None]+args.max_points:
+                size,t = render(plot_figure,estimate_df,max_points=max_points)
+                print('{:>8} {:>14} {:>12} {:10.0f} {:10.2f}'.format(ndays,name,str(max_points),size/1e3,t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+'''
+Benchmark kf with per-row .loc writes against kf(fast=True).
+
+To run:
+    python bench_kf.py
+    python bench_kf.py --steps 10000 1000000 --extrapolate 10000
+
+Every time is measured over the whole series by default; the .loc
+implementation takes many minutes at 1M steps.  For a quick run,
+--extrapolate N times .loc only on the first N steps of longer series and
+scales its per-step cost up.  The 'loc timing' column says which numbers
+are measured and which are estimated.
+'''
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import notebook_helpers as nh
+
+
+def synthetic_series(nsteps,seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2020-03-01',periods=nsteps,freq='D')
+    trend = 100+np.cumsum(rng.normal(0,1,nsteps))
+    return pd.Series(trend+rng.normal(0,10,nsteps),index=index)
+
+
+def time_kf(s,fast):
+    t0 = time.perf_counter()
+    nh.kf(s,100.,20.,fast=fast)
+    return time.perf_counter()-t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps',type=int,nargs='+',default=[10000,1000000])
+    parser.add_argument('--extrapolate',type=int,metavar='N',
+                        help='estimate the .loc time of longer series from their first N steps')
+    args = parser.parse_args()
+
+    # Warm up, so one-off import costs are not charged to the first size
+    time_kf(synthetic_series(10),fast=True)
+    time_kf(synthetic_series(10),fast=False)
+
+    print('{:>10} {:>14} {:>12} {:>10}  {}'.format('steps','loc (s)','fast (s)','speedup','loc timing'))
+    for nsteps in args.steps:
+        s = synthetic_series(nsteps)
+        fast = time_kf(s,fast=True)
+        if args.extrapolate is None or nsteps<=args.extrapolate:
+            slow = time_kf(s,fast=False)
+            how = 'measured'
+        else:
+            slow = time_kf(s.iloc[:args.extrapolate],fast=False)*nsteps/args.extrapolate
+            how = 'ESTIMATED from {} steps'.format(args.extrapolate)
+        print('{:>10} {:14.3f} {:12.3f} {:9.0f}x  {}'.format(nsteps,slow,fast,slow/fast,how))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Benchmark load_data against the memory-mapped cache in data_cache.
+
+To run:
+    python bench_load_data.py
+    python bench_load_data.py --rows 2000 --cols 500
+
+Times load_data, a cold cache build, a warm cache load, and an update after
+one day is appended to the CSV, on a synthetic county CSV.
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import notebook_helpers as nh
+import synthetic
+from data_cache import load_data_cached
+
+
+def timed(fcn,*args):
+    t0 = time.perf_counter()
+    result = fcn(*args)
+    return (result,time.perf_counter()-t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows',type=int,default=1000)
+    parser.add_argument('--cols',type=int,default=200)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        counts = synthetic.synthetic_counts(args.rows+1,args.cols)
+        csvfilepath = os.path.join(tmpdir,'sandiego_data_by_zipcode.csv')
+        counts.iloc[:-1].to_csv(csvfilepath,index=False)
+        cache_dir = os.path.join(tmpdir,'cache')
+
+        timings = []
+        timings.append(('load_data',timed(nh.load_data,csvfilepath)[1]))
+        timings.append(('cache cold',timed(load_data_cached,csvfilepath,cache_dir)[1]))
+        timings.append(('cache warm',timed(load_data_cached,csvfilepath,cache_dir)[1]))
+
+        counts.iloc[-1:].to_csv(csvfilepath,index=False,header=False,mode='a')
+        df,t = timed(load_data_cached,csvfilepath,cache_dir)
+        timings.append(('cache +1 day',t))
+        timings.append(('load_data +1 day',timed(nh.load_data,csvfilepath)[1]))
+
+        print('{} rows x {} columns, {:.1f} MB CSV'.format(args.rows,args.cols+1,os.path.getsize(csvfilepath)/1e6))
+        for name,t in timings:
+            print('{:>18} {:10.4f} s'.format(name,t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+'''
+Benchmark suite for the Kalman Filter pipeline on synthetic data.
+
+For each size (rows x zip code columns) a synthetic county CSV is written to a
+temporary directory and each stage is run: load_data, quiet_period_variance,
+kf (per-row .loc and fast), kf_batch, and plot_figure1 to plot_figure3 with
+the Agg backend.  Every stage is timed (best of --repeat runs) and then run
+once more under tracemalloc for its peak memory.  Results are written as JSON,
+and can be compared against a previous run to flag regressions.
+
+The default sizes stop at 1000x500.  The full scale of the county data,
+5000x2000, has to be asked for with --sizes, since the per-row .loc kf stage
+alone takes a long time at that size.
+
+To run:
+    python bench_pipeline.py
+    python bench_pipeline.py --sizes 100x10 1000x200 5000x2000 --output results.json
+    python bench_pipeline.py --compare results.json
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import notebook_helpers as nh
+import synthetic
+
+
+DEFAULT_SIZES = ['100x10','500x100','1000x500']
+
+
+def pipeline_stages(csvfilepath):
+    '''Stages of the pipeline as (name, function) pairs
+
+    Each function takes the result of the previous stages as a dict and
+    returns a dict of new results.
+    '''
+    def load(res):
+        return {'df':nh.load_data(csvfilepath)}
+
+    def variance(res):
+        df = res['df']
+        return {'qpv':nh.quiet_period_variance(df,df.index[0],df.index[min(30,len(df)-1)])}
+
+    def kf_loc(res):
+        return {'estimate_df':nh.kf(res['df']['TOTAL'],10*res['qpv']['TOTAL'],20)[0].astype(float)}
+
+    def kf_fast(res):
+        return {'estimate_df':nh.kf(res['df']['TOTAL'],10*res['qpv']['TOTAL'],20,fast=True)[0]}
+
+    def kf_batch(res):
+        return {'batch_df':nh.kf_batch(res['df'],10*res['qpv'],20)[0]}
+
+    def plotter(plot_figure):
+        def plot(res):
+            fig,ax = plot_figure(res['estimate_df'])
+            fig.canvas.draw()
+            plt.close(fig)
+            return {}
+        return plot
+
+    return [('load_data',load),
+            ('quiet_period_variance',variance),
+            ('kf',kf_loc),
+            ('kf_fast',kf_fast),
+            ('kf_batch',kf_batch),
+            ('plot_figure1',plotter(nh.plot_figure1)),
+            ('plot_figure2',plotter(nh.plot_figure2)),
+            ('plot_figure3',plotter(nh.plot_figure3))]
+
+
+def run_size(nrows,ncols,repeat,tmpdir):
+    csvfilepath = os.path.join(tmpdir,'sandiego_{}x{}.csv'.format(nrows,ncols))
+    synthetic.write_csv(csvfilepath,nrows,ncols)
+
+    results = []
+    res = {}
+    for name,stage in pipeline_stages(csvfilepath):
+        times = []
+        for k in range(repeat):
+            t0 = time.perf_counter()
+            out = stage(res)
+            times.append(time.perf_counter()-t0)
+
+        tracemalloc.start()
+        stage(res)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        res.update(out)
+        results.append({'rows':nrows,'cols':ncols,'stage':name,
+                        'seconds':min(times),'peak_bytes':peak})
+        print('{:>6} x {:<5} {:>22} {:10.4f} s {:10.1f} MB'.format(nrows,ncols,name,min(times),peak/1e6))
+    return results
+
+
+def compare(results,previous,threshold,min_seconds):
+    '''Print stages that got slower than threshold times the previous run
+
+    Stages faster than min_seconds are ignored, since their timings are noise.
+    '''
+    old = {(r['rows'],r['cols'],r['stage']):r for r in previous['results']}
+    regressions = 0
+    for r in results:
+        key = (r['rows'],r['cols'],r['stage'])
+        if key not in old:
+            continue
+        ratio = r['seconds']/max(old[key]['seconds'],1e-9)
+        if ratio>threshold and r['seconds']>=min_seconds:
+            regressions += 1
+            print('REGRESSION {} x {} {}: {:.4f} s -> {:.4f} s ({:.1f}x)'.format(
+                r['rows'],r['cols'],r['stage'],old[key]['seconds'],r['seconds'],ratio))
+    print('{} regressions against {}'.format(regressions,previous['timestamp']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes',nargs='+',default=DEFAULT_SIZES,help='ROWSxCOLS, e.g. 5000x2000')
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--output',default='bench_results.json')
+    parser.add_argument('--compare',help='previous results JSON to compare against')
+    parser.add_argument('--threshold',type=float,default=1.25,help='slowdown ratio reported as a regression')
+    parser.add_argument('--min-seconds',type=float,default=.01,help='ignore stages faster than this')
+    args = parser.parse_args()
+    if args.repeat<1:
+        parser.error('--repeat must be at least 1')
+
+    tmpdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for size in args.sizes:
+            nrows,ncols = (int(v) for v in size.lower().split('x'))
+            results += run_size(nrows,ncols,args.repeat,tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = {'timestamp':datetime.datetime.now().isoformat(),
+              'python':sys.version.split()[0],
+              'platform':platform.platform(),
+              'numpy':np.__version__,
+              'pandas':pd.__version__,
+              'matplotlib':matplotlib.__version__,
+              'results':results}
+
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as fid:
+            regressions = compare(results,json.load(fid),args.threshold,args.min_seconds)
+    with open(args.output,'w') as fid:
+        json.dump(report,fid,indent=1)
+    print('Results written to {}'.format(args.output))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
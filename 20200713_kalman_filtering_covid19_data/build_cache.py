@@ -0,0 +1,110 @@
+'''
+Fingerprint based build cache for the plot refresh.
+
+Each artifact is recorded in a small JSON file together with the fingerprint
+of everything it was built from (input series, parameters, code).  A stage is
+skipped when the fingerprint is unchanged and its outputs still exist.  Every
+stage logs whether it hit or missed the cache and how long it took.
+'''
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import time
+
+import instrument
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(*parts):
+    '''SHA-1 of pandas objects, arrays, bytes, strings and numbers'''
+    import numpy as np
+    import pandas as pd
+
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part,(pd.Series,pd.DataFrame)):
+            h.update(pd.util.hash_pandas_object(part,index=True).to_numpy().tobytes())
+        elif isinstance(part,np.ndarray):
+            h.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part,bytes):
+            h.update(part)
+        else:
+            h.update(repr(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def file_fingerprint(*paths):
+    '''Fingerprint of the contents of files, e.g. the source of the plotting code'''
+    contents = []
+    for path in paths:
+        with open(path,'rb') as fid:
+            contents.append(fid.read())
+    return fingerprint(*contents)
+
+
+class BuildCache:
+    '''Fingerprints of built artifacts, stored in a JSON file'''
+
+    def __init__(self,path):
+        self.path = path
+        try:
+            with open(path) as fid:
+                self.entries = json.load(fid)
+        except (OSError,ValueError):
+            self.entries = {}
+
+    def is_fresh(self,name,key,outputs=()):
+        '''True if name was built from key and all of its outputs exist'''
+        return self.entries.get(name)==key and all(os.path.exists(p) for p in outputs)
+
+    def update(self,name,key):
+        self.entries[name] = key
+        self._save()
+
+    def discard(self,name):
+        if self.entries.pop(name,None) is not None:
+            self._save()
+
+    def _save(self):
+        with open(self.path+'.tmp','w') as fid:
+            json.dump(self.entries,fid,indent=1)
+        os.replace(self.path+'.tmp',self.path)
+
+    @contextlib.contextmanager
+    def stage(self,name,key=None,outputs=()):
+        '''Time a stage and log whether it hit the cache
+
+        The context yields a dict; if 'hit' is True (set from is_fresh when a
+        key is given) the body should skip the work.  The body can also set
+        'status' to describe a partial update.  The key is recorded only when
+        the body finishes without an exception.  If it raises, the entry for
+        name is dropped, since the outputs may be half written, and the next
+        run rebuilds them whatever the key.  The stage is also recorded by
+        instrument, when enabled.
+        '''
+        info = {'hit':key is not None and self.is_fresh(name,key,outputs),'status':None}
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            with instrument.timer(name):
+                yield info
+            ok = True
+        finally:
+            if not ok:
+                status = 'failed'
+            elif info['status'] is not None:
+                status = info['status']
+            elif key is None:
+                status = 'uncached'
+            else:
+                status = 'hit' if info['hit'] else 'miss'
+            logger.info('%s: %s in %.3f s',name,status,time.perf_counter()-t0)
+            if not ok:
+                self.discard(name)
+            elif key is not None and not info['hit']:
+                self.update(name,key)
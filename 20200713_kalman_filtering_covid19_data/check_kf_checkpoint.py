@@ -0,0 +1,131 @@
+'''
+Check that resumed kf_resume runs match a run from scratch.
+
+A synthetic series is filtered in pieces through one checkpoint (first
+--start days, then --step days at a time), and the stored table is compared
+with kf_resume on the whole series in a fresh checkpoint and with
+kf(fast=True).  Also checked: an interrupted append (table rows written but
+no new state) is ignored, a change of r or of an earlier day recomputes
+everything, and the time of a one-day update does not grow with the table.
+
+To run:
+    python check_kf_checkpoint.py
+    python check_kf_checkpoint.py --days 2000 --start 1500 --step 7
+'''
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import kf_checkpoint as kc
+import notebook_helpers as nh
+
+
+R,Q = 400.,20.
+
+
+def synthetic_series(ndays,seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2020-03-01',periods=ndays,freq='D')
+    return pd.Series(np.cumsum(rng.normal(5,20,ndays)).clip(0),index=index)
+
+
+def max_difference(a,b):
+    return float(np.abs(a[nh.ESTIMATE_COLUMNS].to_numpy()-b[nh.ESTIMATE_COLUMNS].to_numpy()).max())
+
+
+def check_resume(s,start,step,tmpdir,tolerance):
+    '''Failures of a resumed run against runs from scratch'''
+    failures = []
+    pieces = os.path.join(tmpdir,'pieces')
+    resumed = kc.kf_resume(s.iloc[:start],R,Q,pieces)[1]
+    if resumed:
+        failures.append('first run resumed from an empty checkpoint')
+    for stop in range(start+step,len(s)+step,step):
+        if not kc.kf_resume(s.iloc[:stop],R,Q,pieces)[1]:
+            failures.append('appending rows {} to {} recomputed everything'.format(stop-step,stop))
+
+    whole = os.path.join(tmpdir,'whole')
+    kc.kf_resume(s,R,Q,whole)
+    estimates = kc.load_estimates(pieces)
+    for name,reference in (('kf_resume from scratch',kc.load_estimates(whole)),
+                           ('kf(fast=True)',nh.kf(s,R,Q,fast=True)[0])):
+        difference = max_difference(estimates,reference)
+        if not estimates.index.equals(reference.index) or difference>tolerance:
+            failures.append('resumed run differs from {} by {:g}'.format(name,difference))
+    return failures
+
+
+def check_recovery(s,tmpdir,tolerance):
+    '''Failures of interrupted runs and changed inputs'''
+    failures = []
+    path = os.path.join(tmpdir,'recovery')
+    kc.kf_resume(s.iloc[:-10],R,Q,path)
+
+    # Interrupted append: junk rows written beyond nrows, state not saved
+    kc._write_rows(path,len(s)-10,s.index[-10:-5],np.full((5,len(nh.ESTIMATE_COLUMNS)),np.nan))
+    if not kc.kf_resume(s,R,Q,path)[1]:
+        failures.append('interrupted append was not resumed')
+    elif max_difference(kc.load_estimates(path),nh.kf(s,R,Q,fast=True)[0])>tolerance:
+        failures.append('rows of an interrupted append were kept')
+
+    if kc.kf_resume(s,2*R,Q,path)[1]:
+        failures.append('a change of r was resumed')
+    changed = s.copy()
+    changed.iloc[3] += 1
+    if kc.kf_resume(changed,2*R,Q,path)[1]:
+        failures.append('a change of an earlier day was resumed')
+
+    with open(os.path.join(path,kc.STATE_FILE)) as fid:
+        state = json.load(fid)
+    state['filter'] = 'other filter code'
+    with open(os.path.join(path,kc.STATE_FILE),'w') as fid:
+        json.dump(state,fid)
+    if kc.kf_resume(changed,2*R,Q,path)[1]:
+        failures.append('a checkpoint of other filter code was resumed')
+    return failures
+
+
+def time_one_day(ndays,tmpdir):
+    '''Seconds to append one day to a checkpoint of ndays days'''
+    s = synthetic_series(ndays+1,seed=1)
+    path = os.path.join(tmpdir,'time_{}'.format(ndays))
+    kc.kf_resume(s.iloc[:-1],R,Q,path)
+    t0 = time.perf_counter()
+    kc.kf_resume(s,R,Q,path)
+    return time.perf_counter()-t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days',type=int,default=500)
+    parser.add_argument('--start',type=int,default=400)
+    parser.add_argument('--step',type=int,default=1)
+    parser.add_argument('--tolerance',type=float,default=1e-9)
+    args = parser.parse_args()
+
+    s = synthetic_series(args.days)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        failures = check_resume(s,args.start,args.step,tmpdir,args.tolerance)
+        failures += check_recovery(s,tmpdir,args.tolerance)
+        for ndays in (1000,1000000):
+            print('one day appended to {:>8} days: {:.4f} s'.format(ndays,time_one_day(ndays,tmpdir)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for failure in failures:
+        print('FAILED: '+failure)
+    print('{} failures'.format(len(failures)))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
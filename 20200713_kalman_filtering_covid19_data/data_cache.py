@@ -0,0 +1,160 @@
+'''
+Cached, memory-mapped version of notebook_helpers.load_data.
+
+The parsed and differenced frame is stored as columnar .npy files (float32
+values in column-major order, int32 dates) and loaded back with
+np.load(mmap_mode='r').  The cache is keyed on the CSV's size, mtime and
+SHA-1: when rows were only appended, just the new tail is parsed and
+differenced.
+
+The fast path for an unchanged file does not hash the whole CSV.  It trusts
+the size and mtime, plus a SHA-1 of the last TAIL_BYTES of the file, so a
+rewrite of the same size within the mtime granularity is still caught if it
+changes the last rows (where new data goes).  A same-size edit earlier in the
+file that keeps the mtime is not; delete the cache directory after one.
+'''
+
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+META_FILE = 'meta.json'
+VALUES_FILE = 'values.npy'
+DATES_FILE = 'dates.npy'
+TAIL_BYTES = 65536
+
+
+def load_data_cached(csvfilepath,cache_dir=None):
+    '''Load the data and find differences, as load_data, through an on-disk cache
+
+    Inputs:
+        csvfilepath -- path to the county CSV
+        cache_dir -- cache directory (default: .<csv name>.cache next to the CSV)
+
+    Returns:
+        df -- DataFrame of daily differences, float32 and read-only, backed by
+              memory-mapped cache files
+    '''
+    if cache_dir is None:
+        head,tail = os.path.split(os.path.abspath(csvfilepath))
+        cache_dir = os.path.join(head,'.'+tail+'.cache')
+    os.makedirs(cache_dir,exist_ok=True)
+
+    stat = os.stat(csvfilepath)
+    meta = _load_meta(cache_dir)
+    if (meta is not None and meta['size']==stat.st_size and meta['mtime_ns']==stat.st_mtime_ns
+            and meta.get('tail_sha1')==_tail_sha1(csvfilepath,stat.st_size)):
+        df = _load_frame(cache_dir,meta)
+        if df is not None:
+            return df
+
+    with open(csvfilepath,'rb') as fid:
+        content = fid.read()
+    if meta is not None and _is_append(meta,content):
+        meta = _append(cache_dir,meta,content,stat)
+    else:
+        meta = _rebuild(cache_dir,content,stat)
+    return _load_frame(cache_dir,meta)
+
+
+def _tail_sha1(csvfilepath,size):
+    with open(csvfilepath,'rb') as fid:
+        fid.seek(max(0,size-TAIL_BYTES))
+        return hashlib.sha1(fid.read(TAIL_BYTES)).hexdigest()
+
+
+def _parse(content):
+    # Same parsing as load_data, before the difference
+    df = pd.read_csv(io.BytesIO(content),index_col=0,dtype={'Data through':'str'},parse_dates=['Data through'])
+    df.index = pd.to_datetime(df.index)
+    return df.drop(columns='Date Retrieved').fillna(0)
+
+
+def _is_append(meta,content):
+    # The cached file must be an unchanged prefix that ends on a line boundary
+    prefix = content[:meta['size']]
+    return (len(content)>meta['size'] and prefix.endswith(b'\n')
+            and hashlib.sha1(prefix).hexdigest()==meta['sha1'])
+
+
+def _rebuild(cache_dir,content,stat):
+    raw = _parse(content)
+    diff = raw.diff().iloc[1:]
+    _save_arrays(cache_dir,diff.index,diff.to_numpy(dtype=np.float32))
+    return _save_meta(cache_dir,content,stat,raw.columns,raw.index.name,raw.iloc[-1],len(diff))
+
+
+def _append(cache_dir,meta,content,stat):
+    header = content[:content.index(b'\n')+1]
+    raw = _parse(header+content[meta['size']:])
+    if list(raw.columns)!=meta['columns']:
+        return _rebuild(cache_dir,content,stat)
+
+    # Difference the new rows against the last row already in the cache
+    diff = np.diff(np.vstack([meta['last_row'],raw.to_numpy(dtype=float)]),axis=0)
+
+    old = _load_frame(cache_dir,meta)
+    if old is None:
+        return _rebuild(cache_dir,content,stat)
+    index = old.index.append(raw.index)
+    values = np.concatenate([old.to_numpy(),diff.astype(np.float32)])
+    del old
+    _save_arrays(cache_dir,index,values)
+    return _save_meta(cache_dir,content,stat,raw.columns,raw.index.name,raw.iloc[-1],len(index))
+
+
+def _save_arrays(cache_dir,index,values):
+    if (index==index.normalize()).all():
+        dates = (index.to_numpy(dtype='datetime64[D]').astype(np.int64)).astype(np.int32)
+    else:
+        dates = index.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+    # Column-major so every column is contiguous in the file
+    for name,array in [(VALUES_FILE,np.asfortranarray(values)),(DATES_FILE,dates)]:
+        path = os.path.join(cache_dir,name)
+        with open(path+'.tmp','wb') as fid:
+            np.save(fid,array)
+        os.replace(path+'.tmp',path)
+
+
+def _save_meta(cache_dir,content,stat,columns,index_name,last_row,nrows):
+    meta = {'size':stat.st_size,
+            'mtime_ns':stat.st_mtime_ns,
+            'sha1':hashlib.sha1(content).hexdigest(),
+            'tail_sha1':hashlib.sha1(content[-TAIL_BYTES:]).hexdigest(),
+            'columns':list(columns),
+            'index_name':index_name,
+            'last_row':[float(v) for v in last_row],
+            'nrows':nrows}
+    path = os.path.join(cache_dir,META_FILE)
+    with open(path+'.tmp','w') as fid:
+        json.dump(meta,fid)
+    os.replace(path+'.tmp',path)
+    return meta
+
+
+def _load_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir,META_FILE)) as fid:
+            return json.load(fid)
+    except (OSError,ValueError):
+        return None
+
+
+def _load_frame(cache_dir,meta):
+    try:
+        values = np.load(os.path.join(cache_dir,VALUES_FILE),mmap_mode='r')
+        dates = np.load(os.path.join(cache_dir,DATES_FILE))
+    except (OSError,ValueError):
+        return None
+    if values.shape!=(meta['nrows'],len(meta['columns'])) or len(dates)!=meta['nrows']:
+        return None
+
+    unit = 'D' if dates.dtype==np.int32 else 'ns'
+    index = pd.DatetimeIndex(dates.astype(np.int64).astype('datetime64[{}]'.format(unit)),name=meta['index_name'])
+    return pd.DataFrame(values,index=index,columns=meta['columns'],copy=False)
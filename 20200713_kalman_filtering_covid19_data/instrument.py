@@ -0,0 +1,148 @@
+'''
+Stage-level timing, with optional cProfile and tracemalloc capture.
+
+Stages are marked with the timed decorator or the timer context manager.
+Nothing is recorded until enable() is called; while disabled, a decorated
+function costs one extra call and flag check.
+
+Example:
+    import instrument
+    import notebook_helpers as nh
+
+    instrument.enable(memory=True)
+    df = nh.load_data(nh.CSVFILEPATH)
+    with instrument.timer('my stage'):
+        ...
+    instrument.write_report('profile.json')
+'''
+
+import contextlib
+import datetime
+import functools
+import json
+import time
+
+
+_enabled = False
+_profile = False
+_memory = False
+_stages = {}
+_profilers = {}
+_stack = []
+_started = None
+
+
+def enable(profile=False,memory=False):
+    '''Start recording stages, discarding anything recorded before
+
+    Inputs:
+        profile -- run cProfile over each outermost stage
+        memory -- record the peak memory allocated in each stage with tracemalloc
+    '''
+    global _enabled,_profile,_memory,_started
+    _stages.clear()
+    _profilers.clear()
+    _enabled,_profile,_memory = True,profile,memory
+    _started = datetime.datetime.now()
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _memory:
+        import tracemalloc
+        tracemalloc.stop()
+
+
+def timed(name):
+    '''Decorator recording each call of the function as stage name'''
+    def decorator(fcn):
+        @functools.wraps(fcn)
+        def wrapper(*args,**kwargs):
+            if not _enabled:
+                return fcn(*args,**kwargs)
+            with timer(name):
+                return fcn(*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def timer(name):
+    '''Context manager recording its body as stage name'''
+    if not _enabled:
+        yield
+        return
+
+    profiler = None
+    if _profile and not _stack:
+        # cProfile can only run one profiler at a time, so nested stages are timed only
+        import cProfile
+        profiler = _profilers.setdefault(name,cProfile.Profile())
+    frame = {'peak':0,'start_bytes':0}
+    if _memory:
+        import tracemalloc
+        current,peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'],peak)
+        tracemalloc.reset_peak()
+        frame['start_bytes'] = current
+    _stack.append(frame)
+
+    t0 = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter()-t0
+        _stack.pop()
+
+        stage = _stages.setdefault(name,{'name':name,'calls':0,'total_seconds':0.,'max_seconds':0.})
+        stage['calls'] += 1
+        stage['total_seconds'] += seconds
+        stage['max_seconds'] = max(stage['max_seconds'],seconds)
+        if _memory:
+            peak = max(frame['peak'],tracemalloc.get_traced_memory()[1])
+            stage['peak_bytes'] = max(stage.get('peak_bytes',0),peak-frame['start_bytes'])
+            if _stack:
+                _stack[-1]['peak'] = max(_stack[-1]['peak'],peak)
+
+
+def report():
+    '''Recorded stages as a JSON-serializable dict
+
+    With profile=True, each outermost stage lists the functions with the
+    highest cumulative time over all of its calls.
+    '''
+    stages = []
+    for name,stage in _stages.items():
+        stage = dict(stage)
+        if name in _profilers:
+            stage['profile'] = _top_functions(_profilers[name])
+        stages.append(stage)
+    return {'started':_started.isoformat() if _started else None,
+            'profile':_profile,
+            'memory':_memory,
+            'stages':stages}
+
+
+def write_report(path):
+    with open(path,'w') as fid:
+        json.dump(report(),fid,indent=1)
+
+
+def _top_functions(profiler,n=20):
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    rows = []
+    for (filename,line,fcn),(cc,nc,tt,ct,callers) in stats.items():
+        rows.append({'function':'{}:{}({})'.format(filename,line,fcn),
+                     'calls':nc,'tottime':tt,'cumtime':ct})
+    rows.sort(key=lambda row: -row['cumtime'])
+    return rows[:n]
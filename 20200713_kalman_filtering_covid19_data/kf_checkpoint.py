@@ -0,0 +1,156 @@
+'''
+Resumable Kalman Filter runs.
+
+kf_resume keeps the filter state (x, P), the last processed date, r, q and a
+hash of the processed rows in a small checkpoint directory, next to a table
+of the estimates.  When a series only gained new rows since the last run, just
+those rows are fed through the filter and appended to the table.  If r, q, the
+filter code or any already processed row changed, everything is recomputed
+from the first day.
+
+Both the full recompute and the new rows go through notebook_helpers._kf_filter
+(the same as kf(s,r,q,fast=True)), so a resumed run gives the same estimates
+as a run from scratch.  The state records a hash of the filter's source, and a
+checkpoint written by other filter code is recomputed rather than resumed.
+
+The table is stored as raw float64 estimates and int64 dates, like the
+data_cache files, so new rows are appended without reading what is already
+there, and load_estimates memory-maps it rather than parsing it.  Only the
+first nrows rows (from the state file) count, so rows appended by an
+interrupted run are ignored and overwritten.
+'''
+
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import instrument
+import notebook_helpers as nh
+
+
+STATE_FILE = 'state.json'
+VALUES_FILE = 'estimates.f8'
+DATES_FILE = 'dates.i8'
+
+
+@instrument.timed('kf_resume')
+def kf_resume(s,r,q,checkpoint_dir):
+    '''Perform Kalman Filter on pandas Series, resuming from a checkpoint
+
+    Inputs:
+        s -- Pandas series with data to filter, index is datetime
+        r -- measurement noise variance
+        q -- process noise variance
+        checkpoint_dir -- directory for the checkpoint (created if needed)
+
+    Returns:
+        estimate_df -- DataFrame of the rows filtered by this call, with the
+                       same columns as kf (all rows on a full recompute, none
+                       if nothing was new); load_estimates has the whole table
+        resumed -- True if only new rows were filtered, False on a full recompute
+    '''
+    os.makedirs(checkpoint_dir,exist_ok=True)
+    r,q = float(r),float(q)
+
+    state = _load_state(checkpoint_dir)
+    if not _can_resume(state,s,r,q):
+        out = np.empty((len(s),len(nh.ESTIMATE_COLUMNS)))
+        x,P,y = nh._kf_filter(s.to_numpy(dtype=float).tolist(),nh._kf_initial_state(s),[1.,0.,0.,1.],r,q,out)
+        _write_rows(checkpoint_dir,0,s.index,out)
+        _save_state(checkpoint_dir,s,r,q,list(x),list(P))
+        return (pd.DataFrame(out,index=s.index,columns=nh.ESTIMATE_COLUMNS,copy=False),False)
+
+    new = s.iloc[state['nrows']:]
+    out = np.empty((len(new),len(nh.ESTIMATE_COLUMNS)))
+    if len(new):
+        x,P,y = nh._kf_filter(new.to_numpy(dtype=float).tolist(),state['x'],state['P'],r,q,out)
+        _write_rows(checkpoint_dir,state['nrows'],new.index,out)
+        _save_state(checkpoint_dir,s,r,q,list(x),list(P))
+    return (pd.DataFrame(out,index=new.index,columns=nh.ESTIMATE_COLUMNS,copy=False),True)
+
+
+def load_estimates(checkpoint_dir):
+    '''Estimate table stored by kf_resume, read-only and memory-mapped'''
+    state = _load_state(checkpoint_dir)
+    if state is None:
+        raise FileNotFoundError('No checkpoint in {}'.format(checkpoint_dir))
+    nrows,ncols = state['nrows'],len(nh.ESTIMATE_COLUMNS)
+    values = np.memmap(os.path.join(checkpoint_dir,VALUES_FILE),dtype=np.float64,mode='r',shape=(nrows,ncols))
+    dates = np.memmap(os.path.join(checkpoint_dir,DATES_FILE),dtype=np.int64,mode='r',shape=(nrows,))
+    index = pd.DatetimeIndex(np.asarray(dates).astype('datetime64[ns]'),name=state['index_name'])
+    return pd.DataFrame(values,index=index,columns=nh.ESTIMATE_COLUMNS,copy=False)
+
+
+def filter_version():
+    '''Hash of the source of the filter code, stored with the checkpoint'''
+    h = hashlib.sha1()
+    for f in (nh._kf_filter,nh._kf_initial_state):
+        h.update(inspect.getsource(f).encode())
+    return h.hexdigest()
+
+
+def _history_hash(s):
+    h = hashlib.sha1()
+    h.update(s.index.to_numpy(dtype='datetime64[ns]').view('int64').tobytes())
+    h.update(s.to_numpy(dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def _can_resume(state,s,r,q):
+    if state is None or state['r']!=r or state['q']!=q or state.get('filter')!=filter_version():
+        return False
+    nrows = state['nrows']
+    if len(s)<nrows or s.index[nrows-1]!=pd.Timestamp(state['last_date']):
+        return False
+    return _history_hash(s.iloc[:nrows])==state['history_hash']
+
+
+def _load_state(checkpoint_dir):
+    try:
+        with open(os.path.join(checkpoint_dir,STATE_FILE)) as fid:
+            state = json.load(fid)
+    except (OSError,ValueError):
+        return None
+    # The table files must hold the rows the state counts
+    ncols = len(nh.ESTIMATE_COLUMNS)
+    try:
+        if (os.path.getsize(os.path.join(checkpoint_dir,VALUES_FILE))<8*ncols*state['nrows']
+                or os.path.getsize(os.path.join(checkpoint_dir,DATES_FILE))<8*state['nrows']):
+            return None
+    except (OSError,KeyError):
+        return None
+    return state
+
+
+def _save_state(checkpoint_dir,s,r,q,x,P):
+    state = {'x':[float(v) for v in x],
+             'P':[float(v) for v in P],
+             'last_date':s.index[-1].isoformat(),
+             'nrows':len(s),
+             'r':r,
+             'q':q,
+             'filter':filter_version(),
+             'history_hash':_history_hash(s),
+             'index_name':s.index.name}
+
+    # Write then rename so a crash never leaves a half written state file
+    path = os.path.join(checkpoint_dir,STATE_FILE)
+    with open(path+'.tmp','w') as fid:
+        json.dump(state,fid,indent=1)
+    os.replace(path+'.tmp',path)
+
+
+def _write_rows(checkpoint_dir,start,index,values):
+    # Rows go after the first start rows; anything beyond them is from an interrupted run
+    dates = index.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    for name,array in [(VALUES_FILE,np.ascontiguousarray(values,dtype=np.float64)),(DATES_FILE,dates)]:
+        path = os.path.join(checkpoint_dir,name)
+        rowbytes = array.itemsize*(array.shape[1] if array.ndim==2 else 1)
+        with open(path,'r+b' if start and os.path.exists(path) else 'wb') as fid:
+            fid.seek(start*rowbytes)
+            fid.write(array.tobytes())
+            fid.truncate()
@@ -0,0 +1,108 @@
+'''
+Maximum likelihood tuning of the Kalman Filter noise parameters (r, q).
+
+Each candidate (r, q) is scored by the innovation log likelihood of the kf
+model, sum over k of -(log(2*pi*s[k]) + y[k]**2/s[k])/2, where y is the
+measurement residual and s its variance.  All candidates for a series are run
+through _kf_filter together as one batch, and series are spread across a
+process pool.
+
+Example:
+    import notebook_helpers as nh
+    import kf_tuning
+
+    df = nh.load_data(nh.CSVFILEPATH)
+    best, surfaces = kf_tuning.tune(df)
+    estimate_df, f = nh.kf(df['TOTAL'], best.loc['TOTAL','r'], best.loc['TOTAL','q'], fast=True)
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+import notebook_helpers as nh
+
+
+R_GRID = np.logspace(-1,4,26)
+Q_GRID = np.logspace(-2,3,26)
+
+
+def innovation_loglik(z,r,q,chunk=1024):
+    '''Innovation log likelihood of the kf model for one series
+
+    Inputs:
+        z -- 1-d array of measurements
+        r -- measurement noise variance, scalar or array of candidates
+        q -- process noise variance, scalar or array broadcastable with r
+        chunk -- number of time steps filtered between likelihood sums
+
+    Returns:
+        log likelihood, with the broadcast shape of r and q
+    '''
+    z = np.asarray(z,dtype=float)
+    r,q = np.broadcast_arrays(np.asarray(r,dtype=float),np.asarray(q,dtype=float))
+
+    # Initial condition, as in kf
+    x = (z[0],np.mean(np.diff(z[:5])))
+    P = (1.,0.,0.,1.)
+
+    loglik = np.zeros(r.shape)
+    innovations = np.empty((min(chunk,len(z)),)+r.shape+(2,))
+    for m in range(0,len(z),chunk):
+        zm = z[m:m+chunk]
+        inn = innovations[:len(zm)]
+        x,P,y = nh._kf_filter(zm,x,P,r,q,innovations=inn)
+        y,s = inn[...,0],inn[...,1]
+        loglik -= .5*(np.log(2*np.pi*s)+y*y/s).sum(axis=0)
+    return loglik
+
+
+def tune(df,r_grid=R_GRID,q_grid=Q_GRID,refine=False,processes=None):
+    '''Find the maximum likelihood (r, q) for every column of df
+
+    Inputs:
+        df -- Pandas DataFrame (or Series) with data to filter, e.g. from load_data
+        r_grid -- candidate measurement noise variances
+        q_grid -- candidate process noise variances
+        refine -- polish the best grid point of each series with Nelder-Mead
+                  on (log r, log q)
+        processes -- number of worker processes (None for one per core,
+                     1 to run in this process)
+
+    Returns:
+        best -- DataFrame indexed by column with the best r, q and loglik
+        surfaces -- dict mapping each column to a DataFrame of log likelihood,
+                    indexed by r_grid with columns q_grid
+    '''
+    if isinstance(df,pd.Series):
+        df = df.to_frame()
+    r_grid = np.asarray(r_grid,dtype=float)
+    q_grid = np.asarray(q_grid,dtype=float)
+    jobs = [(df[c].to_numpy(dtype=float),r_grid,q_grid,refine) for c in df.columns]
+
+    if processes==1:
+        results = [_tune_series(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_tune_series,jobs,chunksize=max(1,len(jobs)//64)))
+
+    best = pd.DataFrame([res[0] for res in results],index=df.columns,columns=['r','q','loglik'])
+    surfaces = {c:pd.DataFrame(res[1],index=pd.Index(r_grid,name='r'),columns=pd.Index(q_grid,name='q'))
+                for c,res in zip(df.columns,results)}
+    return (best,surfaces)
+
+
+def _tune_series(job):
+    z,r_grid,q_grid,refine = job
+    surface = innovation_loglik(z,r_grid[:,None],q_grid[None,:])
+    i,j = np.unravel_index(np.argmax(surface),surface.shape)
+    best = (r_grid[i],q_grid[j],surface[i,j])
+
+    if refine:
+        res = minimize(lambda p: -innovation_loglik(z,np.exp(p[0]),np.exp(p[1])),
+                       np.log(best[:2]),method='Nelder-Mead',options={'xatol':1e-3,'fatol':1e-6})
+        if -res.fun>best[2]:
+            best = (np.exp(res.x[0]),np.exp(res.x[1]),-res.fun)
+    return (best,surface)
@@ -1,94 +1,123 @@
 
-import filterpy
 import pandas as pd
 import numpy as np
 
 import os
 
-from filterpy.kalman import KalmanFilter 
-from filterpy.common import Q_discrete_white_noise
+import instrument
 
-import matplotlib.pyplot as plt
-from numpy.polynomial import polynomial as P
+# filterpy, scipy and matplotlib are imported in the functions that use them,
+# so filtering with _kf_filter or kf_batch does not pay for their import.
 
 
-CSVFILEPATH = os.path.join('/Users/jen/projects/covid19-san-diego/csv','sandiego_data_by_zipcode.csv')
+CSVFILEPATH = os.environ.get('SDCV19_CSVFILEPATH',
+    os.path.join('/Users/jen/projects/covid19-san-diego/csv','sandiego_data_by_zipcode.csv'))
 
+ESTIMATE_COLUMNS = ['z','x','dx','r','v11','v21','v12','v22']
 
-def plot_figure1(estimate_df):
+
+@instrument.timed('plot_figure1')
+def plot_figure1(estimate_df,ax=None,region='San Diego County',max_points=None,method='lttb'):
     ''' Plot Rolling Mean and Kalman Estimate for Series Data
     Inputs: 
         estimate_df: Pandas Dataframe with Kalman Filter estimates (z, x, dx, r, v11, v21, v12, v22)
+        ax: existing axes to draw into (default: new 16x8 figure)
+        region: name of the region for the title
+        max_points: if given, downsample each plotted series to at most this
+                    many points (see downsample)
+        method: 'lttb' or 'minmax', downsampling method for lines and markers
     Returns:
         fig, ax
     '''
-    fig,ax = plt.subplots(1,1,figsize=(16,8))
-    estimate_df['z'].plot(marker='.',markersize=10,linestyle='none',
+    if ax is None:
+        import matplotlib.pyplot as plt
+        fig,ax = plt.subplots(1,1,figsize=(16,8))
+    else:
+        fig = ax.figure
+    downsample(estimate_df['z'],max_points,method).plot(marker='.',markersize=10,linestyle='none',
         label='Reported New Cases',ax=ax)
     #ax.plot(estimate_df.index,estimate_df['x'],label='Kalman Filter Estimate')
-    estimate_df['x'].plot(ax=ax,linewidth=6,label='Kalman Filter Estimate of $ x $')
-    ax.fill_between(estimate_df.index,
-        estimate_df['x']-np.sqrt(estimate_df['v11']),
-        estimate_df['x']+np.sqrt(estimate_df['v11']),
+    downsample(estimate_df['x'],max_points,method).plot(ax=ax,linewidth=6,label='Kalman Filter Estimate of $ x $')
+    lower,upper = downsample_band(estimate_df['x']-np.sqrt(estimate_df['v11']),
+        estimate_df['x']+np.sqrt(estimate_df['v11']),max_points)
+    ax.fill_between(lower.index,lower,upper,
         color=(1,.3,0,.05),label="+/- 1$ \sigma $ bounds for Kalman Filter Estimate of $ x $")
         
     #Plot rolling LLSQ fits
-    ndays = 14
+    fits = rolling_llsq(estimate_df['z'],[4,7,14])
     for ndays in [4,7,14]:
-        days = np.arange(0,ndays)
-        estimate_df['z'].rolling(ndays).apply(lambda x: P.polyfit(days,x,1)[0]).plot(ax=ax,label='{}-day LLSQ Estimate of $ x $'.format(ndays))
+        downsample(fits[ndays][0],max_points,method).plot(ax=ax,label='{}-day LLSQ Estimate of $ x $'.format(ndays))
     
     ax.legend()
     
-    ax.set_title("Figure 1: Comparison of Kalman Filter and Rolling Window Linear Least Squares Fits\nfor Estimation of New Reported Covid19 Cases Per Day in San Diego County "
+    ax.set_title("Figure 1: Comparison of Kalman Filter and Rolling Window Linear Least Squares Fits\nfor Estimation of New Reported Covid19 Cases Per Day in {} ".format(region)
     )
     ax.set_xlabel('Date')
     ax.set_ylabel('Reported New Cases')
     return (fig,ax)
     
-def plot_figure2(estimate_df):
+@instrument.timed('plot_figure2')
+def plot_figure2(estimate_df,ax=None,region='San Diego County',max_points=None,method='lttb'):
     ''' Plot Rolling Mean and Kalman Estimate for Series Data
     Inputs: 
         estimate_df: Pandas Dataframe with Kalman Filter estimates (z, x, dx, r, v11, v21, v12, v22)
+        ax: existing axes to draw into (default: new 16x8 figure)
+        region: name of the region for the title
+        max_points: if given, downsample each plotted series to at most this
+                    many points (see downsample)
+        method: 'lttb' or 'minmax', downsampling method for lines and markers
     Returns:
         fig, ax
     '''
-    fig,ax = plt.subplots(1,1,figsize=(16,8))
-    estimate_df['z'].diff().plot(marker='.',markersize=10,linestyle='none',
+    if ax is None:
+        import matplotlib.pyplot as plt
+        fig,ax = plt.subplots(1,1,figsize=(16,8))
+    else:
+        fig = ax.figure
+    downsample(estimate_df['z'].diff(),max_points,method).plot(marker='.',markersize=10,linestyle='none',
         label='Reported New Cases',ax=ax)
     #ax.plot(estimate_df.index,estimate_df['x'],label='Kalman Filter Estimate')
-    estimate_df['dx'].plot(ax=ax,linewidth=6,label='Kalman Filter Estimate of $ \dot x $')
-    ax.fill_between(estimate_df.index,
-        estimate_df['dx']-np.sqrt(estimate_df['v22']),
-        estimate_df['dx']+np.sqrt(estimate_df['v22']),
+    downsample(estimate_df['dx'],max_points,method).plot(ax=ax,linewidth=6,label='Kalman Filter Estimate of $ \dot x $')
+    lower,upper = downsample_band(estimate_df['dx']-np.sqrt(estimate_df['v22']),
+        estimate_df['dx']+np.sqrt(estimate_df['v22']),max_points)
+    ax.fill_between(lower.index,lower,upper,
         color=(1,.3,0,.05), label='+/- 1$ \sigma $ Bounds for Kalman Filter Estimate of $ \dot x $')
         
     #Plot rolling LLSQ fits
 
+    fits = rolling_llsq(estimate_df['z'],[4,7,14])
     for ndays in [4,7,14]:
-        days = np.arange(0,ndays)
-        estimate_df['z'].rolling(ndays).apply(lambda x: P.polyfit(days,x,1)[1]).plot(ax=ax,label='{}-day LLSQ Estimate of $ \dot x $'.format(ndays))
+        downsample(fits[ndays][1],max_points,method).plot(ax=ax,label='{}-day LLSQ Estimate of $ \dot x $'.format(ndays))
     
     ax.legend()
     ax.set_xlabel('Date')
     ax.set_ylabel('Daily Rate of Change in Reported New Cases')
-    ax.set_title("Figure 2: Comparison of Kalman Filter and Rolling Window Linear Least Squares Fits\nfor Estimation of Daily Rate of Change of New Reported Covid19 Cases Per Day in San Diego County "
+    ax.set_title("Figure 2: Comparison of Kalman Filter and Rolling Window Linear Least Squares Fits\nfor Estimation of Daily Rate of Change of New Reported Covid19 Cases Per Day in {} ".format(region)
     )
     return (fig,ax)
     
     
-def plot_figure3(estimate_df):
+@instrument.timed('plot_figure3')
+def plot_figure3(estimate_df,ax=None,max_points=None,method='lttb'):
     ''' Plot Change in New Cases Per Day for Series Data
     Inputs: 
         estimate_df: Pandas Dataframe with Kalman Filter estimates (z, x, dx, r, v11, v21, v12, v22)
+        ax: existing axes to draw into (default: new 16x8 figure)
+        max_points: if given, downsample each plotted series to at most this
+                    many points (see downsample)
+        method: 'lttb' or 'minmax', downsampling method for lines
     Returns:
         fig, ax
     '''
-    fig,ax1 = plt.subplots(1,1,figsize=(16,8))
-    estimate_df['dx'].plot(ax=ax1,label='Kalman Filter Estimate of $ \dot x $')
-    ax1.fill_between(estimate_df.index,
-        estimate_df['dx']-np.sqrt(estimate_df['v22']),
-        estimate_df['dx']+np.sqrt(estimate_df['v22']),
+    if ax is None:
+        import matplotlib.pyplot as plt
+        fig,ax1 = plt.subplots(1,1,figsize=(16,8))
+    else:
+        fig,ax1 = ax.figure,ax
+    downsample(estimate_df['dx'],max_points,method).plot(ax=ax1,label='Kalman Filter Estimate of $ \dot x $')
+    lower,upper = downsample_band(estimate_df['dx']-np.sqrt(estimate_df['v22']),
+        estimate_df['dx']+np.sqrt(estimate_df['v22']),max_points)
+    ax1.fill_between(lower.index,lower,upper,
         color=(1,.3,0,.05),label="+/- 1$ \sigma $")
     ax1.legend(loc='upper left')
     ax1.set_title("Figure 3:  A Closer Look at Kalman Filter Estimate of Rate of Change of New Cases Per Day ($ \dot x $)")
@@ -99,9 +128,153 @@ def plot_figure3(estimate_df):
     
     
     
+def downsample(s,max_points,method='lttb'):
+    ''' Downsample a Series for plotting, keeping its peaks
+    
+    Inputs:
+        s: Pandas Series; NaNs are dropped when downsampling
+        max_points: maximum number of points to keep (None to keep all)
+        method: 'lttb' (largest triangle three buckets, for lines) or 'minmax'
+                (minimum and maximum of each bucket)
+    Returns:
+        s, or the selected rows of s
+    '''
+    if max_points is None:
+        return s
+    s = s.dropna()
+    if len(s)<=max_points:
+        return s
+    if method=='lttb':
+        keep = lttb_indices(s.to_numpy(dtype=float),max_points)
+    elif method=='minmax':
+        keep = minmax_indices([s.to_numpy(dtype=float)],max_points)
+    else:
+        raise ValueError("method must be 'lttb' or 'minmax', not {!r}".format(method))
+    return s.iloc[keep]
+
+
+def downsample_band(lower,upper,max_points):
+    ''' Downsample the bounds of a fill_between band with min/max bucketing
+    
+    The extremes of both bounds in each bucket are kept, so the band keeps its
+    full extent.
+    
+    Returns:
+        lower, upper: Series sharing the same (selected) index
+    '''
+    if max_points is None:
+        return (lower,upper)
+    keep = lower.notna()&upper.notna()
+    lower,upper = lower[keep],upper[keep]
+    if len(lower)<=max_points:
+        return (lower,upper)
+    keep = minmax_indices([lower.to_numpy(dtype=float),upper.to_numpy(dtype=float)],max_points)
+    return (lower.iloc[keep],upper.iloc[keep])
+
+
+def lttb_indices(y,n_out):
+    ''' Largest triangle three buckets downsampling of evenly spaced points
+    
+    Keeps the first and last point, and from each of n_out-2 buckets in between
+    the point forming the largest triangle with the previously kept point and
+    the mean of the next bucket.
+    
+    Returns:
+        sorted integer positions of the n_out kept points
+    '''
+    n = len(y)
+    if n_out>=n:
+        return np.arange(0,n)
+    if n_out<3:
+        return np.array([0,n-1])[:n_out]
+    
+    edges = (np.arange(0,n_out-1)*(n-2)/(n_out-2)).astype(int)+1
+    edges[-1] = n-1
+    keep = np.empty(n_out,dtype=int)
+    keep[0] = 0
+    keep[-1] = n-1
+    a = 0
+    for i in range(0,n_out-2):
+        lo,hi = edges[i],edges[i+1]
+        
+        # Mean of the next bucket (the last point for the final bucket)
+        nlo,nhi = hi,(edges[i+2] if i+2<len(edges) else n)
+        avg_x = (nlo+nhi-1)/2
+        avg_y = y[nlo:nhi].mean()
+        
+        t = np.arange(lo,hi)
+        area = np.abs((a-avg_x)*(y[lo:hi]-y[a])-(a-t)*(avg_y-y[a]))
+        a = lo+int(np.argmax(area))
+        keep[i+1] = a
+    return keep
+
+
+def minmax_indices(ys,n_out):
+    ''' Positions of the minimum and maximum of each bucket
+    
+    Inputs:
+        ys: list of equal length arrays; the minimum and maximum of each array
+            in each bucket are kept
+        n_out: maximum number of points to keep
+    Returns:
+        sorted unique integer positions, including the first and last point
+    '''
+    n = len(ys[0])
+    nbuckets = max(1,(n_out-2)//(2*len(ys)))
+    edges = np.linspace(0,n,nbuckets+1).astype(int)
+    keep = [np.array([0,n-1])]
+    for y in ys:
+        keep.append(edges[:-1]+_bucket_argmin(y,edges))
+        keep.append(edges[:-1]+_bucket_argmin(-y,edges))
+    return np.unique(np.concatenate(keep))
+
+
+def _bucket_argmin(y,edges):
+    # Argmin within each bucket [edges[i],edges[i+1]), by padding buckets to equal length
+    width = np.max(np.diff(edges))
+    idx = edges[:-1,None]+np.arange(0,width)[None,:]
+    valid = idx<edges[1:,None]
+    vals = np.where(valid,y[np.minimum(idx,len(y)-1)],np.inf)
+    return np.argmin(vals,axis=1)
+
+
+@instrument.timed('rolling_llsq')
+def rolling_llsq(df,windows):
+    ''' Rolling window linear least squares fits from running sums
+    
+    For each window length n, fits x = b0 + b1*t with t = 0,...,n-1 over the n
+    rows ending at each row, the same as 
+    df.rolling(n).apply(lambda x: P.polyfit(np.arange(0,n),x,1)[i]) but from
+    closed form sums, for all columns at once.
+    
+    Inputs:
+        df: Pandas Series or DataFrame, rows are time steps
+        windows: window lengths (number of rows)
+    Returns:
+        dict mapping each window length to (intercept, slope), both shaped like df
+    '''
+    t = np.arange(0,len(df),dtype=float)
+    ty = df.mul(t,axis=0)
+    
+    fits = {}
+    for n in windows:
+        # Sums over the window of y and of (t-t0)*y, where t0 is the first row of the window
+        sy = df.rolling(n).sum()
+        sty = ty.rolling(n).sum()-sy.mul(t-(n-1),axis=0)
+        
+        st = n*(n-1)/2
+        stt = (n-1)*n*(2*n-1)/6
+        slope = (n*sty-st*sy)/(n*stt-st*st)
+        intercept = (sy-slope*st)/n
+        fits[n] = (intercept,slope)
+    return fits
+    
+    
+@instrument.timed('load_data')
 def load_data(csvfilepath):
     # Load the data and find differences
     df = pd.read_csv(csvfilepath,index_col=0,dtype={'Data through':'str'},parse_dates=['Data through'])
+    df.index = pd.to_datetime(df.index)
     df = df.drop(columns='Date Retrieved').fillna(0)
     df = df.diff()  
     return df.iloc[1:]
@@ -111,27 +284,92 @@ def quiet_period_variance(df:pd.DataFrame,quiet_period_start:pd.Timestamp,quiet_
     measurement_variance[measurement_variance==0]=.05
     return measurement_variance
 
-def kf(s,r,q):
+def find_quiet_period(df,windows=(28,31,42,56)):
+    '''Find the lowest variance window of each column, for use in place of quiet_period_variance
+    
+    The variance of every window of every candidate length is computed for all
+    columns at once from cumulative sums.  Windows where a column is all zeros
+    (before reporting started) are skipped.  As in quiet_period_variance, a
+    variance of zero is replaced by .05.
+    
+    Inputs:
+        df: Pandas DataFrame (or Series) of daily values, index is datetime
+        windows: candidate quiet period lengths in days (rows)
+    Returns:
+        measurement_variance: Series of the lowest window variance per column
+        quiet_periods: DataFrame with the start, stop and ndays of that window per column
+    '''
+    series = isinstance(df,pd.Series)
+    if series:
+        df = df.to_frame()
+    values = df.to_numpy(dtype=float)
+    
+    # Center each column to limit cancellation in sum(x**2)-sum(x)**2/n
+    centered = values-np.nanmean(values,axis=0) if len(values) else values
+    zero = np.zeros((1,values.shape[1]))
+    c1 = np.concatenate([zero,np.cumsum(centered,axis=0)])
+    c2 = np.concatenate([zero,np.cumsum(centered**2,axis=0)])
+    cabs = np.concatenate([zero,np.cumsum(np.abs(values),axis=0)])
+    
+    best_var = np.full(values.shape[1],np.inf)
+    best_start = np.full(values.shape[1],-1)
+    best_n = np.zeros(values.shape[1],dtype=int)
+    for n in windows:
+        if n<2 or n>len(values):
+            continue
+        s1 = c1[n:]-c1[:-n]
+        var = np.clip((c2[n:]-c2[:-n]-s1*s1/n)/(n-1),0,None)
+        var[(cabs[n:]-cabs[:-n])==0] = np.inf
+        start = np.argmin(var,axis=0)
+        var = var[start,np.arange(var.shape[1])]
+        better = var<best_var
+        best_var[better] = var[better]
+        best_start[better] = start[better]
+        best_n[better] = n
+    
+    found = best_start>=0
+    best_var[~found] = 0
+    measurement_variance = pd.Series(best_var,index=df.columns)
+    measurement_variance[measurement_variance==0]=.05
+    
+    quiet_periods = pd.DataFrame({'start':pd.NaT,'stop':pd.NaT,'ndays':best_n},index=df.columns)
+    quiet_periods.loc[found,'start'] = df.index[best_start[found]]
+    quiet_periods.loc[found,'stop'] = df.index[best_start[found]+best_n[found]-1]
+    if series:
+        return (measurement_variance.iloc[0],quiet_periods.iloc[0])
+    return (measurement_variance,quiet_periods)
+
+
+@instrument.timed('kf')
+def kf(s,r,q,fast=False,steady_state=False,tol=1e-9):
     '''Perform Kalman Filter on pandas Series
     
     Inputs:
         s -- Pandas series with data to filter, index is datetime
         r -- measurement noise variance (use 10*quiet_period_variance)
         q -- process noise variance (use 20)
+        fast -- store the estimates in a preallocated float64 array and wrap it
+                in estimate_df once at the end, instead of writing each time
+                step into the DataFrame with .loc
+        steady_state -- run the exact filter only until the covariance is within
+                        tol (relative) of the steady state solution of the
+                        discrete Riccati equation, then run the rest of the
+                        series as a fixed gain linear recurrence (implies fast)
+        tol -- convergence tolerance for steady_state
     
     Returns:
+        estimate_df -- DataFrame with columns z, x, dx, r, v11, v21, v12, v22
         f -- Kalman Filter model
     '''
     
     
-    estimate_columns = ['z','x','dx','r','v11','v21','v12','v22']
-    estimate_df = pd.DataFrame(index=s.index, columns=estimate_columns)
-    estimate_df=estimate_df.fillna(0)
+    from filterpy.kalman import KalmanFilter 
+    from filterpy.common import Q_discrete_white_noise
     
     # NCV model 
     f = KalmanFilter(dim_x=2,dim_z=1)
     # Initial condition
-    f.x = np.array([s[0],s.diff()[1:5].mean()])
+    f.x = np.array(_kf_initial_state(s))
     
     # State transition matrix
     f.F = np.array([[1.,1.,],[0,1.,]])
@@ -147,8 +385,29 @@ def kf(s,r,q):
 
     # Add noise profile
     f.Q = Q_discrete_white_noise(dim=2, dt=1, var = q)
+    
+    if steady_state:
+        out = np.empty((len(s),len(ESTIMATE_COLUMNS)))
+        x,P,y = _kf_filter_steady_state(s.to_numpy(dtype=float),f.x.tolist(),f.P.ravel().tolist(),float(r),float(q),out,tol)
+        f.x = np.array(x)
+        f.P = np.reshape(P,(2,2))
+        f.y = np.array([y])
+        estimate_df = pd.DataFrame(out,index=s.index,columns=ESTIMATE_COLUMNS,copy=False)
+        return (estimate_df,f)
+    
+    if fast:
+        out = np.empty((len(s),len(ESTIMATE_COLUMNS)))
+        x,P,y = _kf_filter(s.to_numpy(dtype=float).tolist(),f.x.tolist(),f.P.ravel().tolist(),float(r),float(q),out)
+        f.x = np.array(x)
+        f.P = np.reshape(P,(2,2))
+        f.y = np.array([y])
+        estimate_df = pd.DataFrame(out,index=s.index,columns=ESTIMATE_COLUMNS,copy=False)
+        return (estimate_df,f)
+    
+    estimate_df = pd.DataFrame(index=s.index, columns=ESTIMATE_COLUMNS)
+    estimate_df=estimate_df.fillna(0)
     for k in range(0,len(estimate_df)):
-        z = s[k]
+        z = s.iloc[k]
         f.predict()
         f.update(z)
         estimate_df.loc[estimate_df.index[k],'z'] = z
@@ -156,6 +415,234 @@ def kf(s,r,q):
         estimate_df.loc[estimate_df.index[k],'r'] = f.y**2
         estimate_df.loc[estimate_df.index[k],['v11','v21','v12','v22']] = list(np.reshape(f.P,4))
     return (estimate_df,f)
+
+
+@instrument.timed('kf_batch')
+def kf_batch(df,r,q):
+    '''Perform Kalman Filter on every column of a pandas DataFrame at once
+    
+    Same constant velocity model as kf, but all columns are stacked into NumPy
+    arrays and filtered together, so the cost is one pass over time rather than
+    one pass per column.
+    
+    Inputs:
+        df -- Pandas DataFrame with data to filter (e.g. from load_data), index is datetime
+        r -- measurement noise variance, scalar or Series indexed by column
+             (use 10*quiet_period_variance)
+        q -- process noise variance (use 20)
+    
+    Returns:
+        estimate_df -- DataFrame with a column level for each column of df and
+                       a second level (z, x, dx, r, v11, v21, v12, v22) as in kf
+        x -- final state estimates, shape (ncolumns,2)
+        P -- final covariance matrices, shape (ncolumns,2,2)
+    '''
+    z = df.to_numpy(dtype=float)
+    r = pd.Series(r,index=df.columns).to_numpy(dtype=float)
+    
+    # Initial condition, as in kf
+    x = (z[0],df.diff().iloc[1:5].mean().to_numpy(dtype=float))
+    P = (np.ones(z.shape[1]),np.zeros(z.shape[1]),np.zeros(z.shape[1]),np.ones(z.shape[1]))
+    
+    out = np.empty(z.shape+(len(ESTIMATE_COLUMNS),))
+    x,P,y = _kf_filter(z,x,P,r,q,out)
+    
+    columns = pd.MultiIndex.from_product([df.columns,ESTIMATE_COLUMNS])
+    estimate_df = pd.DataFrame(out.reshape(len(z),-1),index=df.index,columns=columns,copy=False)
+    return (estimate_df,np.stack(x,axis=-1),np.stack(P,axis=-1).reshape(-1,2,2))
+
+
+@instrument.timed('rts_smooth')
+def rts_smooth(estimate_df,q):
+    '''Rauch-Tung-Striebel smoother pass over kf or kf_batch output
+    
+    Uses the stored filtered means (x, dx) and covariances (v11..v22), so the
+    filter does not have to be re-run.  The smoother gains for every time step
+    and column are computed at once; only the backward recursion loops over time.
+    
+    Inputs:
+        estimate_df -- DataFrame from kf, or from kf_batch (one column level per series)
+        q -- process noise variance used for the filter
+    
+    Returns:
+        smoothed_df -- DataFrame with the same columns as estimate_df, with x, dx
+                       and v11..v22 replaced by the smoothed means and
+                       covariances (z and r are copied from estimate_df)
+    '''
+    from filterpy.common import Q_discrete_white_noise
+    
+    batch = isinstance(estimate_df.columns,pd.MultiIndex)
+    nsteps = len(estimate_df)
+    est = estimate_df.to_numpy(dtype=float).reshape(nsteps,-1,len(ESTIMATE_COLUMNS))
+    
+    F = np.array([[1.,1.],[0,1.]])
+    Q = Q_discrete_white_noise(dim=2, dt=1, var = q)
+    
+    # Filtered means and covariances, shape (time, column, 2) and (time, column, 2, 2)
+    x = est[...,1:3]
+    P = est[...,4:8].reshape(nsteps,-1,2,2)
+    
+    # Predicted covariances and smoother gains for every step
+    P_pred = F@P[:-1]@F.T+Q
+    C = P[:-1]@F.T@np.linalg.inv(P_pred)
+    
+    xs = x.copy()
+    Ps = P.copy()
+    for k in range(nsteps-2,-1,-1):
+        xs[k] = x[k]+(C[k]@(xs[k+1]-x[k]@F.T)[...,None])[...,0]
+        Ps[k] = P[k]+C[k]@(Ps[k+1]-P_pred[k])@C[k].swapaxes(-1,-2)
+    
+    out = est.copy()
+    out[...,1:3] = xs
+    out[...,4:8] = Ps.reshape(nsteps,-1,4)
+    if not batch:
+        out = out[:,0,:]
+    return pd.DataFrame(out.reshape(nsteps,-1),index=estimate_df.index,columns=estimate_df.columns,copy=False)
+
+
+def _kf_initial_state(s):
+    '''Initial state of kf: the first value and the mean of the next four differences'''
+    return [float(s.iloc[0]),float(s.diff().iloc[1:5].mean())]
+
+
+def _kf_filter(z,x,P,r,q,out=None,innovations=None):
+    '''Run the constant velocity Kalman Filter recursion over z
+    
+    The 2x2 algebra is written out element by element (Joseph form update, as in
+    filterpy), so the state and covariance elements can be floats for a single
+    series or arrays for a batch of series.
+    
+    Inputs:
+        z -- measurements, time along the first axis
+        x -- initial state (x, dx)
+        P -- initial covariance elements (p11, p12, p21, p22)
+        r -- measurement noise variance
+        q -- process noise variance
+        out -- optional array of shape z.shape+(8,) to store the estimates
+               in ESTIMATE_COLUMNS order
+        innovations -- optional array of shape z.shape+(2,) (or with the
+                       broadcast shape of r and q) to store the measurement
+                       residual y and its variance s at each step
+    
+    Returns:
+        x, P -- final state and covariance elements
+        y -- final measurement residual
+    '''
+    x1,x2 = x
+    p11,p12,p21,p22 = P
+    
+    # Q_discrete_white_noise(dim=2, dt=1, var=q)
+    q11,q12,q22 = .25*q,.5*q,q
+    
+    for k in range(0,len(z)):
+        zk = z[k]
+        
+        # Predict: x = F x, P = F P F' + Q
+        x1 = x1+x2
+        p11,p12,p21,p22 = (p11+p12+p21+p22+q11,p12+p22+q12,p21+p22+q12,p22+q22)
+        
+        # Update
+        y = zk-x1
+        s = p11+r
+        k1 = p11/s
+        k2 = p21/s
+        x1 = x1+k1*y
+        x2 = x2+k2*y
+        a = 1-k1
+        p11,p12,p21,p22 = (a*a*p11+k1*k1*r,
+                           a*(p12-k2*p11)+k1*k2*r,
+                           a*(p21-k2*p11)+k1*k2*r,
+                           k2*k2*p11-k2*(p12+p21)+p22+k2*k2*r)
+        
+        if out is not None:
+            out[k,...,0] = zk
+            out[k,...,1] = x1
+            out[k,...,2] = x2
+            out[k,...,3] = y*y
+            out[k,...,4] = p11
+            out[k,...,5] = p12
+            out[k,...,6] = p21
+            out[k,...,7] = p22
+        if innovations is not None:
+            innovations[k,...,0] = y
+            innovations[k,...,1] = s
+    return ((x1,x2),(p11,p12,p21,p22),y)
+
+
+def _kf_steady_state(r,q):
+    '''Steady state gain and covariance of the constant velocity Kalman Filter
+    
+    Returns:
+        K -- steady state Kalman gain, shape (2,)
+        P -- steady state (posterior) covariance, shape (2,2)
+    '''
+    from filterpy.common import Q_discrete_white_noise
+    from scipy.linalg import solve_discrete_are
+    
+    F = np.array([[1.,1.],[0,1.]])
+    H = np.array([[1.,0]])
+    Q = Q_discrete_white_noise(dim=2, dt=1, var = q)
+    
+    # solve_discrete_are gives the prior covariance of the filter
+    P_prior = solve_discrete_are(F.T,H.T,Q,np.array([[r]]))
+    K = P_prior[:,0]/(P_prior[0,0]+r)
+    P = (np.eye(2)-np.outer(K,H))@P_prior
+    return (K,P)
+
+
+def _kf_filter_steady_state(z,x,P,r,q,out,tol=1e-9,chunk=16):
+    '''Run _kf_filter until P converges, then finish with the steady state gain
+    
+    Once the gain is fixed, the update x = (I-KH) F x + K z is a linear
+    recurrence, so the remaining steps are run as two second order IIR filters
+    (one per state) with scipy.signal.lfilter.
+    
+    Inputs:
+        z -- measurements, 1-d float array
+        x, P, r, q -- as for _kf_filter
+        out -- array of shape (len(z),8) to store the estimates
+        tol -- relative tolerance on P for switching to the steady state gain
+        chunk -- number of exact steps between convergence checks
+    
+    Returns:
+        x, P, y -- final state, covariance elements and measurement residual
+    '''
+    from scipy.signal import lfilter
+    
+    K,P_ss = _kf_steady_state(r,q)
+    
+    # Exact filter until the covariance has converged
+    m = 0
+    y = 0.
+    while m<len(z):
+        x,P,y = _kf_filter(z[m:m+chunk].tolist(),x,P,r,q,out[m:m+chunk])
+        m = min(m+chunk,len(z))
+        if np.max(np.abs(np.subtract(P,P_ss.ravel())))<=tol*np.max(np.abs(P_ss)):
+            break
+    if m==len(z):
+        return (x,P,y)
+    
+    # Steady state: x[k] = A x[k-1] + K z[k]
+    k1,k2 = K
+    A = np.array([[1-k1,1-k1],[-k2,1-k2]])
+    a = [1.,-np.trace(A),np.linalg.det(A)]
+    x0 = np.array(x)
+    Ax0 = A@x0
+    tail = z[m:]
+    x1 = lfilter([k1,-A[1,1]*k1+A[0,1]*k2],a,tail,zi=[Ax0[0],-a[2]*x0[0]])[0]
+    x2 = lfilter([k2,A[1,0]*k1-A[0,0]*k2],a,tail,zi=[Ax0[1],-a[2]*x0[1]])[0]
+    
+    # Residuals against the predicted measurement x[k-1]+dx[k-1]
+    x1_prev = np.concatenate([[x0[0]],x1[:-1]])
+    x2_prev = np.concatenate([[x0[1]],x2[:-1]])
+    y = tail-(x1_prev+x2_prev)
+    
+    out[m:,0] = tail
+    out[m:,1] = x1
+    out[m:,2] = x2
+    out[m:,3] = y*y
+    out[m:,4:] = P_ss.ravel()
+    return ((x1[-1],x2[-1]),tuple(P_ss.ravel()),y[-1])
     
 
 
@@ -169,4 +656,4 @@ def plot_county_level_lls_vs_kalman(df):
     total_ts.toolbar_location = None
     total_ts.legend.location = 'top_left'
     
-    
\ No newline at end of file
+    
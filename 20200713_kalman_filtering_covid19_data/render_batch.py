@@ -0,0 +1,128 @@
+'''
+Render plot_figure1-3 for every zip code across a process pool.
+
+Each worker switches to the Agg backend and creates a single 16x8 figure
+when it starts.  Every job clears the figure and draws into new axes with the
+plot_figure functions, so no figures are created per job and nothing a job
+drew (pandas keeps the plotted series on its axes) is kept by the next one.
+The figure is a matplotlib.figure.Figure, not registered with pyplot, so it
+goes with the worker process.  When run in this process (processes=1) the
+backend is left alone and the figure is dropped when rendering ends.
+
+Example:
+    import notebook_helpers as nh
+    import render_batch
+
+    df = nh.load_data(nh.CSVFILEPATH)
+    estimate_df = nh.kf_batch(df,10*nh.find_quiet_period(df)[0],20)[0]
+    render_batch.render_figures(estimate_df,'figures')
+
+To run:
+    python render_batch.py sandiego_data_by_zipcode.csv figures --format png
+'''
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+
+FIGURES = (1,2,3)
+
+_fig = None
+
+
+def render_figures(estimate_df,outdir,figures=FIGURES,fmt='svg',processes=None):
+    '''Write plot_figure1-3 for every series of a kf_batch estimate frame
+
+    Inputs:
+        estimate_df -- DataFrame from kf_batch, or dict of kf estimate frames by name
+        outdir -- output directory, files are <name>_figure<n>.<fmt>
+        figures -- which of plot_figure1, 2 and 3 to draw
+        fmt -- 'svg' or 'png'
+        processes -- number of worker processes (None for one per core,
+                     1 to render in this process)
+
+    Returns:
+        list of the files written
+    '''
+    os.makedirs(outdir,exist_ok=True)
+    if isinstance(estimate_df,pd.DataFrame):
+        names = estimate_df.columns.get_level_values(0).unique()
+        series = ((name,estimate_df[name]) for name in names)
+    else:
+        series = estimate_df.items()
+    jobs = [(str(name),est,tuple(figures),outdir,fmt) for name,est in series]
+
+    if processes==1:
+        _new_figure()
+        try:
+            paths = [_render(job) for job in jobs]
+        finally:
+            _close_worker()
+    else:
+        with ProcessPoolExecutor(max_workers=processes,initializer=_init_worker) as pool:
+            paths = list(pool.map(_render,jobs,chunksize=max(1,len(jobs)//(4*(os.cpu_count() or 1)))))
+    return [p for job_paths in paths for p in job_paths]
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    _new_figure()
+
+
+def _new_figure():
+    global _fig
+    from matplotlib.figure import Figure
+    _fig = Figure(figsize=(16,8))
+
+
+def _close_worker():
+    global _fig
+    _fig = None
+
+
+def _render(job):
+    import notebook_helpers as nh
+    name,est,figures,outdir,fmt = job
+    region = 'San Diego County' if name=='TOTAL' else 'Zip Code {}'.format(name)
+
+    paths = []
+    for n in figures:
+        # New axes each time: ax.clear() leaves the series pandas keeps in ax._plot_data
+        _fig.clf()
+        ax = _fig.add_subplot(1,1,1)
+        if n==1:
+            nh.plot_figure1(est,ax=ax,region=region)
+        elif n==2:
+            nh.plot_figure2(est,ax=ax,region=region)
+        else:
+            nh.plot_figure3(est,ax=ax)
+        path = os.path.join(outdir,'{}_figure{}.{}'.format(name,n,fmt))
+        _fig.savefig(path,format=fmt)
+        paths.append(path)
+    _fig.clf()
+    return paths
+
+
+def main():
+    import notebook_helpers as nh
+
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csvfilepath')
+    parser.add_argument('outdir')
+    parser.add_argument('--format',default='svg',choices=['svg','png'])
+    parser.add_argument('--processes',type=int,default=None)
+    parser.add_argument('--q',type=float,default=20)
+    args = parser.parse_args()
+
+    df = nh.load_data(args.csvfilepath)
+    estimate_df = nh.kf_batch(df,10*nh.find_quiet_period(df)[0],args.q)[0]
+    paths = render_figures(estimate_df,args.outdir,fmt=args.format,processes=args.processes)
+    print('Wrote {} files to {}'.format(len(paths),args.outdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+'''
+Synthetic San Diego style case count CSVs for benchmarks.
+
+The files have the same layout as sandiego_data_by_zipcode.csv: a
+'Data through' date column, a 'Date Retrieved' column, one column of
+cumulative case counts per zip code and a TOTAL column.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def synthetic_counts(nrows,ncols,seed=0):
+    '''Cumulative case counts for ncols zip codes over nrows days
+
+    Returns:
+        DataFrame in the layout of the county CSV (before load_data)
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-03-20',periods=nrows,freq='D')
+
+    # Daily new cases follow a slowly drifting rate per zip code
+    log_rate = np.log(rng.uniform(.5,20,ncols))+np.cumsum(rng.normal(0,.03,(nrows,ncols)),axis=0)
+    new_cases = rng.poisson(np.exp(np.clip(log_rate,-5,8)))
+    counts = np.cumsum(new_cases,axis=0)
+
+    zips = [str(92000+k) for k in range(ncols)]
+    df = pd.DataFrame(counts,columns=zips)
+    df['TOTAL'] = counts.sum(axis=1)
+    df.insert(0,'Date Retrieved',(dates+pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+    df.insert(0,'Data through',dates.strftime('%Y-%m-%d'))
+    return df
+
+
+def write_csv(path,nrows,ncols,seed=0):
+    '''Write a synthetic case count CSV readable by notebook_helpers.load_data'''
+    synthetic_counts(nrows,ncols,seed).to_csv(path,index=False)
+    return path
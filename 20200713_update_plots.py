@@ -1,31 +1,108 @@
-import common.sdcv19 as sdcv19
-import pandas as pd
+'''
+Nightly refresh of plots/kf_estimate.svg: load -> filter -> plot.
 
-import os
+To run:
+    python 20200713_update_plots.py            # same as "all"
+    python 20200713_update_plots.py filter     # load the county data and update the filter checkpoint
+    python 20200713_update_plots.py plot       # redraw the figure from the stored estimates
+    python 20200713_update_plots.py all
+
+Heavy modules are imported only by the stages that need them: common.sdcv19
+by load, the filter code (numpy and pandas only) by filter, and
+common.kalman_filter (matplotlib) by plot.  Compare startup with
+    python -X importtime 20200713_update_plots.py filter 2> importtime.log
 
-from common.kalman_filter import plot_kf_estimate
-from common.kalman_filter import kf
+To see where the time of a run goes, write a per-stage timing report:
+    python 20200713_update_plots.py --report profile.json
+    python 20200713_update_plots.py --report profile.json --cprofile --tracemalloc
+'''
 
+import argparse
 import datetime
+import logging
+import os
+import sys
+
+THIS_PATH = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0,os.path.join(THIS_PATH,'20200713_kalman_filtering_covid19_data'))
+from build_cache import BuildCache, fingerprint, file_fingerprint
+import instrument
 
+CHECKPOINT_DIR = os.path.join(THIS_PATH,'plots','kf_checkpoint')
+FIGFILENAME = os.path.join(THIS_PATH,'plots','kf_estimate.svg')
 
-sddata = sdcv19.get_county_newcases()
-#import pdb; pdb.set_trace()
-z = sddata['TOTAL']
 
+def load(cache):
+    with cache.stage('load'):
+        import common.sdcv19 as sdcv19
+        import pandas as pd
 
-quiet_period_start = pd.Timestamp(2020,4,20)
-quiet_period_stop = pd.Timestamp(2020,5,20)
+        with instrument.timer('get_county_newcases'):
+            sddata = sdcv19.get_county_newcases()
+        #import pdb; pdb.set_trace()
+        z = sddata['TOTAL']
 
-quiet_period = z.loc[(z.index>=pd.Timestamp(2020,4,20))&(z.index<=pd.Timestamp(2020,6,15))]
-qpv = quiet_period.var()
+        quiet_period = z.loc[(z.index>=pd.Timestamp(2020,4,20))&(z.index<=pd.Timestamp(2020,6,15))]
+        qpv = quiet_period.var()
+    return (z,10*qpv,20)
 
 
-estimate_df = kf(z,10*qpv,20)[0]
-fig, (ax1,ax2) = plot_kf_estimate(estimate_df)
-ax2.text(0,-0.2, "Figure last updated {date:%Y-%m-%d %I:%M %p}.\nLatest estimates: x={x:.1f}; dx={dx:.1f} ".format(date=datetime.datetime.now(),x=estimate_df.iloc[-1,1],dx=estimate_df.iloc[-1,2]), size=12, ha="center", 
-         transform=ax2.transAxes)
+def run_filter(cache,z,r,q):
+    # Only the days added since the last run are filtered; r, q or history changes trigger a full recompute
+    with cache.stage('filter',fingerprint(z,r,q),[CHECKPOINT_DIR]) as stage:
+        if not stage['hit']:
+            from kf_checkpoint import kf_resume
+            resumed = kf_resume(z,r,q,CHECKPOINT_DIR)[1]
+            stage['status'] = 'tail update' if resumed else 'full recompute'
 
-THIS_PATH = os.path.abspath(os.path.dirname(__file__))
-figfilename = os.path.join(THIS_PATH,'plots','kf_estimate.svg')
-fig.savefig(figfilename)
+
+def plot(cache):
+    # The figure depends on the stored estimates and the plotting code
+    state_file = os.path.join(CHECKPOINT_DIR,'state.json')
+    if not os.path.exists(state_file):
+        sys.exit('No stored estimates in {}, run the filter stage first'.format(CHECKPOINT_DIR))
+    with open(state_file,'rb') as fid:
+        state = fid.read()
+    import importlib.util
+    plot_code_version = file_fingerprint(importlib.util.find_spec('common.kalman_filter').origin,__file__)
+
+    with cache.stage('kf_estimate.svg',fingerprint(state,plot_code_version),[FIGFILENAME]) as stage:
+        if stage['hit']:
+            return
+        from common.kalman_filter import plot_kf_estimate
+        from kf_checkpoint import load_estimates
+
+        estimate_df = load_estimates(CHECKPOINT_DIR)
+        with instrument.timer('plot_kf_estimate'):
+            fig, (ax1,ax2) = plot_kf_estimate(estimate_df)
+        ax2.text(0,-0.2, "Figure last updated {date:%Y-%m-%d %I:%M %p}.\nLatest estimates: x={x:.1f}; dx={dx:.1f} ".format(date=datetime.datetime.now(),x=estimate_df.iloc[-1,1],dx=estimate_df.iloc[-1,2]), size=12, ha="center",
+                 transform=ax2.transAxes)
+        with instrument.timer('savefig'):
+            fig.savefig(FIGFILENAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command',nargs='?',default='all',choices=['filter','plot','all'])
+    parser.add_argument('--report',help='write per-stage timings to this JSON file')
+    parser.add_argument('--cprofile',action='store_true',help='add the top functions of each stage to the report')
+    parser.add_argument('--tracemalloc',action='store_true',help='add the peak memory of each stage to the report')
+    args = parser.parse_args()
+    if args.report:
+        instrument.enable(profile=args.cprofile,memory=args.tracemalloc)
+
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s')
+    cache = BuildCache(os.path.join(THIS_PATH,'plots','build_cache.json'))
+
+    if args.command in ('filter','all'):
+        run_filter(cache,*load(cache))
+    if args.command in ('plot','all'):
+        plot(cache)
+
+    if args.report:
+        instrument.write_report(args.report)
+        logging.info('Timing report written to %s',args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+'''
+Asyncio API for the example4 transaction and lot model.
+
+The after_insert listeners of example4 run synchronously inside a flush.
+Here buys and sells are awaitable Core statements on an AsyncSession, with
+the same FIFO semantics: a sell takes the open Lot of its account with the
+earliest (buy_date, buy_transaction_id), using the ix_lot_open index.
+
+Many accounts can be processed concurrently on one event loop with ingest.
+Trades of one account are applied in order under an asyncio.Lock for that
+account.  SQLite has a single writer, so the transactions of different
+accounts take turns on an asyncio.Lock for the engine, and the loop runs
+other work while they wait.  The database is set up as in file_engine.py
+(WAL, busy timeout, BEGIN IMMEDIATE) for writers in other processes.
+
+Example:
+    import asyncio
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from async_lots import create_async_file_engine, create_schema, buy, sell
+
+    async def main():
+        engine = create_async_file_engine('lots.db')
+        await create_schema(engine)
+        DBSession = async_sessionmaker(engine)
+        async with DBSession.begin() as session:
+            buy_id = await buy(session,datetime.date(2021,9,1),'A')
+            sell_id,lot_id = await sell(session,datetime.date(2021,9,8),'A')
+        await engine.dispose()
+
+    asyncio.run(main())
+
+Requires aiosqlite and greenlet (pip install sqlalchemy[asyncio] aiosqlite).
+'''
+
+import asyncio
+import collections
+import random
+import weakref
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from example4 import DEFAULT_ACCOUNT, Base, BuyTransaction, Lot, SellTransaction, Transaction
+from file_engine import configure_sqlite, is_locked_error
+
+
+def create_async_file_engine(path,pool_size=5,max_overflow=10,busy_timeout=30.):
+    '''AsyncEngine for the SQLite database file at path, see create_file_engine'''
+    engine = create_async_engine('sqlite+aiosqlite:///'+path,
+                                 pool_size=pool_size,max_overflow=max_overflow,
+                                 connect_args={'timeout':busy_timeout})
+    configure_sqlite(engine.sync_engine,busy_timeout)
+    return engine
+
+
+async def create_schema(engine):
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+
+async def buy(session,date,account=DEFAULT_ACCOUNT):
+    '''Insert a buy transaction and its Lot
+
+    Returns:
+        transaction_id of the buy
+    '''
+    transaction_table = Transaction.__table__
+    result = await session.execute(
+        insert(transaction_table).returning(transaction_table.c.transaction_id),
+        [{'date':date,'type':BuyTransaction.__mapper__.polymorphic_identity,'account':account}])
+    buy_transaction_id = result.scalar_one()
+    await session.execute(insert(Lot.__table__),
+                          [{'buy_transaction_id':buy_transaction_id,'account':account,'buy_date':date}])
+    return buy_transaction_id
+
+
+async def sell(session,date,account=DEFAULT_ACCOUNT):
+    '''Insert a sell transaction and assign it the oldest open Lot of account
+
+    Returns:
+        (transaction_id of the sell, buy_transaction_id of its Lot)
+
+    Raises ValueError, before inserting the sell, if the account has no open lot.
+    '''
+    transaction_table = Transaction.__table__
+    lot_table = Lot.__table__
+    qstmt = select(lot_table.c.buy_transaction_id). \
+            where(lot_table.c.account == account). \
+            where(lot_table.c.sell_transaction_id == None). \
+            order_by(lot_table.c.buy_date,lot_table.c.buy_transaction_id). \
+            limit(1)
+    buy_transaction_id = (await session.execute(qstmt)).scalar()
+    if buy_transaction_id is None:
+        raise ValueError('No open Lot in account {} for sell on {}'.format(account,date))
+
+    result = await session.execute(
+        insert(transaction_table).returning(transaction_table.c.transaction_id),
+        [{'date':date,'type':SellTransaction.__mapper__.polymorphic_identity,'account':account}])
+    sell_transaction_id = result.scalar_one()
+    await session.execute(update(lot_table).
+                          where(lot_table.c.buy_transaction_id == buy_transaction_id).
+                          values(sell_transaction_id=sell_transaction_id))
+    return (sell_transaction_id,buy_transaction_id)
+
+
+# asyncio.Lock by account or engine, for each event loop
+_locks = weakref.WeakKeyDictionary()
+
+
+def _lock(key):
+    loop = asyncio.get_running_loop()
+    return _locks.setdefault(loop,collections.defaultdict(asyncio.Lock))[key]
+
+
+async def ingest_account(DBSession,account,trades,batch=20,retries=10,backoff=.05):
+    '''Apply trades of one account in order, batch trades per transaction
+
+    Inputs:
+        DBSession -- async_sessionmaker
+        account -- account of the trades
+        trades -- iterable of ('buy' or 'sell', date)
+        batch -- trades per transaction
+        retries, backoff -- retries of a transaction if the database is locked,
+                            as in file_engine.run_transaction
+
+    Returns:
+        list of the seconds each transaction took, including waiting for the database
+    '''
+    trades = list(trades)
+    seconds = []
+    loop = asyncio.get_running_loop()
+    # SQLite takes one writer at a time, so the tasks of this loop queue for the
+    # engine here rather than in the busy handler, which polls and is not FIFO
+    write_lock = _lock(('engine',id(DBSession.kw['bind'])))
+    async with _lock(('account',account)):
+        for start in range(0,len(trades),batch):
+            t0 = loop.time()
+            for attempt in range(retries+1):
+                try:
+                    async with write_lock, DBSession.begin() as session:
+                        for kind,date in trades[start:start+batch]:
+                            if kind=='buy':
+                                await buy(session,date,account)
+                            else:
+                                await sell(session,date,account)
+                    break
+                except Exception as exc:
+                    if not is_locked_error(exc) or attempt==retries:
+                        raise
+                    await asyncio.sleep(backoff*2**attempt*random.uniform(.5,1.5))
+            seconds.append(loop.time()-t0)
+    return seconds
+
+
+async def ingest(DBSession,trades_by_account,batch=20):
+    '''Run ingest_account for every account concurrently
+
+    Inputs:
+        trades_by_account -- dict of trades, as for ingest_account, by account
+
+    Returns:
+        dict of the transaction times from ingest_account, by account
+    '''
+    accounts = list(trades_by_account)
+    results = await asyncio.gather(*(ingest_account(DBSession,account,trades_by_account[account],batch)
+                                     for account in accounts))
+    return dict(zip(accounts,results))
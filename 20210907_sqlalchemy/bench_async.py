@@ -0,0 +1,122 @@
+'''
+Benchmark the asyncio lot API against the sync ORM listeners.
+
+The same random trade stream (--accounts accounts, --trades buys and sells
+each) is ingested into a fresh SQLite file, in transactions of --batch
+trades, by
+
+    sync   -- one Session with the example4 listeners, account after account
+    async  -- async_lots.ingest, all accounts concurrently on one event loop
+
+Reported are the throughput and the latency of a transaction (from its
+start, including any wait for the database lock, to its commit).  Both
+databases are checked against a FIFO replay of their trades.
+
+To run:
+    python bench_async.py
+    python bench_async.py --accounts 50 --trades 1000 --batch 10
+'''
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from example4 import Base, BuyTransaction, SellTransaction
+from async_lots import create_async_file_engine, create_schema, ingest
+from file_engine import create_file_engine, run_transaction
+from stress_writers import check_fifo
+
+
+START_DATE = datetime.date(2021,1,1)
+
+
+def synthetic_trades(naccounts,ntrades,seed=0):
+    '''dict of [('buy' or 'sell', date), ...] by account; no sell without an open lot'''
+    rng = random.Random(seed)
+    trades_by_account = {}
+    for k in range(naccounts):
+        held = 0
+        trades = []
+        for n in range(ntrades):
+            date = START_DATE+datetime.timedelta(days=rng.randrange(365))
+            if held and rng.random()<.45:
+                held -= 1
+                trades.append(('sell',date))
+            else:
+                held += 1
+                trades.append(('buy',date))
+        trades_by_account['ACCT{:03d}'.format(k)] = trades
+    return trades_by_account
+
+
+def run_sync(path,trades_by_account,batch):
+    engine = create_file_engine(path)
+    Base.metadata.create_all(engine)
+    DBSession = sessionmaker(bind=engine)
+    classes = {'buy':BuyTransaction,'sell':SellTransaction}
+
+    latencies = []
+    t0 = time.perf_counter()
+    for account,trades in trades_by_account.items():
+        for start in range(0,len(trades),batch):
+            t1 = time.perf_counter()
+            run_transaction(DBSession,lambda session: session.add_all(
+                [classes[kind](date=date,account=account) for kind,date in trades[start:start+batch]]))
+            latencies.append(time.perf_counter()-t1)
+    seconds = time.perf_counter()-t0
+    mismatches = check_fifo(engine)
+    engine.dispose()
+    return (seconds,np.array(latencies),mismatches)
+
+
+async def _run_async(path,trades_by_account,batch):
+    engine = create_async_file_engine(path)
+    await create_schema(engine)
+    DBSession = async_sessionmaker(engine)
+    t0 = time.perf_counter()
+    latencies = await ingest(DBSession,trades_by_account,batch)
+    seconds = time.perf_counter()-t0
+    await engine.dispose()
+    return (seconds,np.concatenate([np.array(v) for v in latencies.values()]))
+
+
+def run_async(path,trades_by_account,batch):
+    seconds,latencies = asyncio.run(_run_async(path,trades_by_account,batch))
+    engine = create_file_engine(path)
+    mismatches = check_fifo(engine)
+    engine.dispose()
+    return (seconds,latencies,mismatches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts',type=int,default=20)
+    parser.add_argument('--trades',type=int,default=500,help='trades per account')
+    parser.add_argument('--batch',type=int,default=20,help='trades per transaction')
+    args = parser.parse_args()
+
+    trades_by_account = synthetic_trades(args.accounts,args.trades)
+    ntrades = args.accounts*args.trades
+    tmpdir = tempfile.mkdtemp()
+    print('{:>6} {:>8} {:>9} {:>10} {:>10} {:>10} {:>6}'.format('path','trades','seconds','trades/s','p50 ms','p99 ms','fifo'))
+    try:
+        for name,run in (('sync',run_sync),('async',run_async)):
+            seconds,latencies,mismatches = run(os.path.join(tmpdir,name+'.db'),trades_by_account,args.batch)
+            print('{:>6} {:>8} {:9.2f} {:10.0f} {:10.2f} {:10.2f} {:>6}'.format(
+                name,ntrades,seconds,ntrades/seconds,1e3*np.percentile(latencies,50),1e3*np.percentile(latencies,99),
+                'ok' if mismatches==0 else '{} wrong'.format(mismatches)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
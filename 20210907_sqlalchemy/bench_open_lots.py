@@ -0,0 +1,99 @@
+'''
+Benchmark the cost of FIFO matching one sell as the number of lots grows.
+
+For each lot count, an in-memory database is loaded with that many buys
+(random dates), and the oldest --closed fraction of lots is sold with
+bulk_sell.  Then --sells SellTransactions are added and flushed one at a
+time through the after_insert listener, in three modes:
+
+    scan   -- ix_lot_open dropped: scan the open lots and sort them per sell
+    index  -- the open lot is the first entry of ix_lot_open
+    queue  -- an OpenLotQueue attached to the session, no query at all
+
+Latencies are per flushed sell (insert + match).  The queue's one-off load
+from the database is reported separately.
+
+To run:
+    python bench_open_lots.py
+    python bench_open_lots.py --lots 10000 100000 1000000 3000000 --sells 2000
+'''
+
+import argparse
+import datetime
+import random
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from example4 import Base, Lot, SellTransaction
+from bulk import bulk_buy, bulk_sell
+from open_lot_queue import attach_open_lot_queue
+
+
+MODES = ['scan','index','queue']
+START_DATE = datetime.date(2000,1,1)
+
+
+def load_lots(engine,nlots,closed,seed=0):
+    '''Insert nlots buys and their lots, then sell the oldest closed fraction'''
+    rng = random.Random(seed)
+    with engine.begin() as connection:
+        bulk_buy(connection,[START_DATE+datetime.timedelta(days=rng.randrange(7300)) for k in range(nlots)])
+        if closed:
+            bulk_sell(connection,[START_DATE]*int(closed*nlots))
+
+
+def time_sells(engine,mode,nsells):
+    session = sessionmaker(bind=engine)()
+    load_seconds = None
+    if mode=='scan':
+        session.execute(text('DROP INDEX ix_lot_open'))
+    elif mode=='queue':
+        t0 = time.perf_counter()
+        attach_open_lot_queue(session).load(session.connection())
+        load_seconds = time.perf_counter()-t0
+
+    latencies = []
+    for k in range(nsells):
+        t0 = time.perf_counter()
+        session.add(SellTransaction(date=START_DATE))
+        session.flush()
+        latencies.append(time.perf_counter()-t0)
+    session.rollback()
+    session.close()
+    if mode=='scan':
+        # pysqlite does not open a transaction for DDL, so the DROP INDEX was not rolled back
+        ix_lot_open, = (ix for ix in Lot.__table__.indexes if ix.name=='ix_lot_open')
+        ix_lot_open.create(engine)
+    return np.array(latencies),load_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lots',type=int,nargs='+',default=[1000,10000,100000,1000000])
+    parser.add_argument('--sells',type=int,default=500,help='sells timed per mode')
+    parser.add_argument('--closed',type=float,default=.5,help='fraction of lots already sold')
+    parser.add_argument('--modes',nargs='+',default=MODES,choices=MODES)
+    parser.add_argument('--scan-max',type=int,default=100000,help='skip the scan mode above this many lots')
+    args = parser.parse_args()
+
+    print('{:>9} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('lots','mode','mean us','p50 us','p99 us','load s'))
+    for nlots in args.lots:
+        engine = create_engine('sqlite+pysqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        load_lots(engine,nlots,args.closed)
+        nsells = min(args.sells,int((1-args.closed)*nlots))
+        for mode in args.modes:
+            if mode=='scan' and nlots>args.scan_max:
+                continue
+            latencies,load_seconds = time_sells(engine,mode,nsells)
+            print('{:>9} {:>6} {:10.1f} {:10.1f} {:10.1f} {:>10}'.format(
+                nlots,mode,1e6*latencies.mean(),1e6*np.percentile(latencies,50),1e6*np.percentile(latencies,99),
+                '' if load_seconds is None else '{:.3f}'.format(load_seconds)))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
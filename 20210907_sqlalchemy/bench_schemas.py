@@ -0,0 +1,218 @@
+'''
+Scaling benchmark of the lot model layouts.
+
+    separate -- example3: buy_transaction and sell_transaction tables, the
+                buy date on buy_transaction
+    sti      -- example4: one transaction table with a type discriminator
+                (single table inheritance), the buy date copied to Lot.buy_date
+
+and each layout is run with and without an index for the open lot lookup
+(--indexes), so that the layouts are compared under the same conditions:
+
+    none -- separate: no index; sti: ix_lot_open dropped
+    open -- separate: ix_buy_transaction_date on buy_transaction
+            (transaction_date, buy_transaction_id) and ix_lot_open on
+            lot (buy_transaction_id) where there is no sell
+            sti: example4's ix_lot_open
+
+Both listeners look up the open lot with LIMIT 1.  The separate layout has
+no buy date on lot to index, so even with its indexes the lookup walks the
+buy dates in order past the sold lots (see the query plans); that is the
+cost of the layout, not of a missing index.
+
+For each size, the same synthetic trade stream (60% buys, dates over ten
+years) is written to a fresh SQLite file for each layout and index:
+
+    load   -- buys and their lots, then the sells matched FIFO, with set-based
+              statements as in bulk.py; reported as trades per second
+    match  -- --match-sells more sells added and flushed one at a time through
+              the layout's after_insert listener; latency percentiles
+    plan   -- EXPLAIN QUERY PLAN of the listener's open lot lookup
+    size   -- database file size after the load
+
+Without an index, every sell scans and sorts the open lots, so the match
+latency grows with the size; use fewer --match-sells at millions of trades.
+
+To run:
+    python bench_schemas.py
+    python bench_schemas.py --sizes 10000 100000 1000000 5000000 --match-sells 20
+'''
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, func, insert, select, update
+from sqlalchemy.orm import sessionmaker
+
+import example3
+import example4
+from bulk import bulk_buy, bulk_sell
+
+
+START_DATE = datetime.date(2012,1,1)
+SCHEMAS = ['separate','sti']
+INDEXES = ['none','open']
+
+# Open lot indexes of the separate layout, the counterpart of example4's ix_lot_open
+SEPARATE_OPEN_INDEXES = [
+    'CREATE INDEX ix_buy_transaction_date ON buy_transaction (transaction_date, buy_transaction_id)',
+    'CREATE INDEX ix_lot_open ON lot (buy_transaction_id) WHERE sell_transaction_id IS NULL']
+
+
+def trade_stream(ntrades,seed=0):
+    '''(buy dates, sell dates) of ntrades trades, 60% buys'''
+    rng = random.Random(seed)
+    nbuys = int(.6*ntrades)
+    buy_dates = [START_DATE+datetime.timedelta(days=rng.randrange(3650)) for k in range(nbuys)]
+    sell_dates = [START_DATE+datetime.timedelta(days=3650)]*(ntrades-nbuys)
+    return (buy_dates,sell_dates)
+
+
+def load_separate(connection,buy_dates,sell_dates):
+    tables = example3.Base.metadata.tables
+    buy_table,sell_table,lot_table = tables['buy_transaction'],tables['sell_transaction'],tables['lot']
+
+    connection.execute(insert(buy_table),[{'transaction_date':d} for d in buy_dates])
+    connection.execute(insert(lot_table).from_select(['buy_transaction_id'],select(buy_table.c.buy_transaction_id)))
+
+    # sell_transaction has no columns but its id; rowids are consecutive, see bulk.bulk_sell
+    first = (connection.execute(select(func.max(sell_table.c.sell_transaction_id))).scalar() or 0)+1
+    connection.execute(insert(sell_table),[{'sell_transaction_id':first+k} for k in range(len(sell_dates))])
+    ranked_lots = select(lot_table.c.buy_transaction_id,
+                         func.row_number().over(order_by=(buy_table.c.transaction_date,lot_table.c.buy_transaction_id)).label('n')). \
+            join_from(lot_table,buy_table). \
+            where(lot_table.c.sell_transaction_id == None). \
+            subquery('ranked_lots')
+    matches = select(ranked_lots.c.buy_transaction_id,(ranked_lots.c.n+(first-1)).label('sell_transaction_id')). \
+            where(ranked_lots.c.n<=len(sell_dates)). \
+            subquery('matches')
+    connection.execute(update(lot_table).
+                       where(lot_table.c.buy_transaction_id == matches.c.buy_transaction_id).
+                       values(sell_transaction_id=matches.c.sell_transaction_id))
+
+
+def load_sti(connection,buy_dates,sell_dates):
+    bulk_buy(connection,buy_dates)
+    bulk_sell(connection,sell_dates)
+
+
+def fifo_query(schema):
+    '''The open lot lookup of the schema's SellTransaction listener'''
+    if schema=='separate':
+        tables = example3.Base.metadata.tables
+        return select(tables['lot'].c.buy_transaction_id). \
+                where(tables['lot'].c.sell_transaction_id == None). \
+                join_from(tables['lot'],tables['buy_transaction']). \
+                order_by(tables['buy_transaction'].c.transaction_date). \
+                limit(1)
+    lot_table = example4.Lot.__table__
+    return select(lot_table.c.buy_transaction_id). \
+            where(lot_table.c.account == example4.DEFAULT_ACCOUNT). \
+            where(lot_table.c.sell_transaction_id == None). \
+            order_by(lot_table.c.buy_date,lot_table.c.buy_transaction_id). \
+            limit(1)
+
+
+def query_plan(engine,stmt):
+    compiled = stmt.compile(engine)
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN '+str(compiled),
+                                          tuple(compiled.params[k] for k in compiled.positiontup))
+        return '; '.join(row[-1] for row in rows)
+
+
+def time_matches(engine,schema,nsells):
+    session = sessionmaker(bind=engine)()
+    date = START_DATE+datetime.timedelta(days=3650)
+    latencies = []
+    for k in range(nsells):
+        sell = example3.SellTransaction() if schema=='separate' else example4.SellTransaction(date=date)
+        t0 = time.perf_counter()
+        session.add(sell)
+        session.flush()
+        latencies.append(time.perf_counter()-t0)
+    session.rollback()
+    session.close()
+    return np.array(latencies)
+
+
+def create_schema(engine,schema,indexes):
+    '''Create the layout's tables, with or without its open lot index'''
+    base = example3.Base if schema=='separate' else example4.Base
+    base.metadata.create_all(engine)
+    # DDL rather than Index objects, so the models' metadata is left as it is
+    with engine.begin() as connection:
+        if schema=='separate' and indexes=='open':
+            for ddl in SEPARATE_OPEN_INDEXES:
+                connection.exec_driver_sql(ddl)
+        elif schema=='sti' and indexes=='none':
+            connection.exec_driver_sql('DROP INDEX ix_lot_open')
+
+
+def run(schema,indexes,path,buy_dates,sell_dates,match_sells):
+    engine = create_engine('sqlite+pysqlite:///'+path)
+    create_schema(engine,schema,indexes)
+
+    t0 = time.perf_counter()
+    with engine.begin() as connection:
+        (load_separate if schema=='separate' else load_sti)(connection,buy_dates,sell_dates)
+    load_seconds = time.perf_counter()-t0
+
+    latencies = time_matches(engine,schema,match_sells)
+    plan = query_plan(engine,fifo_query(schema))
+    engine.dispose()
+    return {'schema':schema,
+            'indexes':indexes,
+            'trades':len(buy_dates)+len(sell_dates),
+            'load_seconds':load_seconds,
+            'trades_per_second':(len(buy_dates)+len(sell_dates))/load_seconds,
+            'match_ms':{p:1e3*np.percentile(latencies,p) for p in (50,90,99)},
+            'plan':plan,
+            'file_bytes':os.path.getsize(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes',type=int,nargs='+',default=[10000,100000,1000000],help='trades')
+    parser.add_argument('--schemas',nargs='+',default=SCHEMAS,choices=SCHEMAS)
+    parser.add_argument('--indexes',nargs='+',default=INDEXES,choices=INDEXES,help='open lot index')
+    parser.add_argument('--match-sells',type=int,default=100,help='sells timed through the listener')
+    parser.add_argument('--dir',help='directory for the database files (default: a temporary directory)')
+    args = parser.parse_args()
+
+    tmpdir = args.dir or tempfile.mkdtemp()
+    print('{:>8} {:>7} {:>9} {:>10} {:>9} {:>9} {:>9} {:>9}'.format(
+        'schema','index','trades','trades/s','p50 ms','p90 ms','p99 ms','MB'))
+    plans = {}
+    try:
+        for ntrades in args.sizes:
+            buy_dates,sell_dates = trade_stream(ntrades)
+            for schema in args.schemas:
+                for indexes in args.indexes:
+                    path = os.path.join(tmpdir,'{}_{}_{}.db'.format(schema,indexes,ntrades))
+                    if os.path.exists(path):
+                        os.remove(path)
+                    r = run(schema,indexes,path,buy_dates,sell_dates,args.match_sells)
+                    print('{:>8} {:>7} {:>9} {:10.0f} {:9.2f} {:9.2f} {:9.2f} {:9.1f}'.format(
+                        schema,indexes,r['trades'],r['trades_per_second'],
+                        r['match_ms'][50],r['match_ms'][90],r['match_ms'][99],r['file_bytes']/1e6))
+                    plans[(schema,indexes,ntrades)] = r['plan']
+                    if not args.dir:
+                        os.remove(path)
+    finally:
+        if not args.dir:
+            shutil.rmtree(tmpdir)
+
+    print('\nOpen lot lookup query plans:')
+    for (schema,indexes,ntrades),plan in plans.items():
+        print('  {:>8} {:>4} {:>9}: {}'.format(schema,indexes,ntrades,plan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+Bulk loading and FIFO lot matching for the example4 model.
+
+The after_insert listener on BuyTransaction inserts its Lot with a statement
+of its own, so loading N buys through the session costs 2N statements.
+bulk_buy inserts the buys with one batched INSERT ... RETURNING and then all
+of their lots with one INSERT ... SELECT.
+
+The after_insert listener on SellTransaction matches one sell at a time: a
+SELECT for the oldest open Lot and an UPDATE, two round trips per sell.
+bulk_sell inserts a whole batch of sells with one executemany and then
+matches all of them with a single UPDATE ... FROM:
+
+    open lots, oldest first          sells, in insert order
+    (buy_date, buy_transaction_id)   (transaction_id)
+            n = 1, 2, ...  <-- join on n -->  n = 1, 2, ...
+
+The n-th sell gets the n-th open lot, which is the same assignment the
+listener makes when the sells are added one after another.
+
+Both functions work below the ORM: Lot objects already loaded in a session
+are not refreshed (expire them to see the changes), and an OpenLotQueue
+attached to the session must be invalidated.
+
+Example:
+    from bulk import bulk_buy, bulk_sell
+
+    buy_ids = bulk_buy(session.connection(),buy_dates)
+    sell_ids = bulk_sell(session.connection(),sell_dates)
+    session.commit()
+'''
+
+from sqlalchemy import func, insert, select, update
+
+from example4 import DEFAULT_ACCOUNT, BuyTransaction, Lot, SellTransaction, Transaction
+
+
+def bulk_buy(connection,dates,account=DEFAULT_ACCOUNT):
+    '''Insert buy transactions and their Lots
+
+    Inputs:
+        connection -- SQLAlchemy Connection, e.g. session.connection()
+        dates -- dates of the buys
+        account -- account of the buys
+
+    Returns:
+        list of the new buy transaction_ids, in insert order
+    '''
+    transaction_table = Transaction.__table__
+    lot_table = Lot.__table__
+    dates = list(dates)
+    if not dates:
+        return []
+
+    buy_type = BuyTransaction.__mapper__.polymorphic_identity
+    buy_ids = sorted(connection.execute(
+        insert(transaction_table).returning(transaction_table.c.transaction_id),
+        [{'date':d,'type':buy_type,'account':account} for d in dates]).scalars())
+
+    new_buys = select(transaction_table.c.transaction_id,transaction_table.c.account,transaction_table.c.date). \
+            where(transaction_table.c.transaction_id.between(buy_ids[0],buy_ids[-1])). \
+            where(transaction_table.c.type == buy_type). \
+            where(transaction_table.c.account == account)
+    connection.execute(insert(lot_table).from_select(['buy_transaction_id','account','buy_date'],new_buys))
+    return buy_ids
+
+
+def bulk_sell(connection,dates,account=DEFAULT_ACCOUNT):
+    '''Insert sell transactions and assign each one an open Lot in FIFO order
+
+    Inputs:
+        connection -- SQLAlchemy Connection, e.g. session.connection()
+        dates -- dates of the sells, in the order they happen
+        account -- account of the sells, matched to that account's lots
+
+    Returns:
+        list of the new sell transaction_ids, in insert order
+
+    Raises ValueError, before inserting anything, if the account has fewer
+    open lots than sells.
+    '''
+    transaction_table = Transaction.__table__
+    lot_table = Lot.__table__
+    dates = list(dates)
+    if not dates:
+        return []
+
+    nopen = connection.execute(select(func.count()).
+                               where(lot_table.c.account == account).
+                               where(lot_table.c.sell_transaction_id == None)).scalar()
+    if nopen<len(dates):
+        raise ValueError('{} sells but only {} open lots in account {}'.format(len(dates),nopen,account))
+
+    sell_type = SellTransaction.__mapper__.polymorphic_identity
+    # Batched multi-row INSERT ... RETURNING; sort_by_parameter_order would make SQLite insert row by row
+    sell_ids = sorted(connection.execute(
+        insert(transaction_table).returning(transaction_table.c.transaction_id),
+        [{'date':d,'type':sell_type,'account':account} for d in dates]).scalars())
+
+    # The first len(dates) entries of the ix_lot_open index
+    open_lots = select(lot_table.c.buy_transaction_id,lot_table.c.buy_date). \
+            where(lot_table.c.account == account). \
+            where(lot_table.c.sell_transaction_id == None). \
+            order_by(lot_table.c.buy_date,lot_table.c.buy_transaction_id). \
+            limit(len(dates)). \
+            subquery('open_lots')
+    ranked_lots = select(open_lots.c.buy_transaction_id,
+                         func.row_number().over(order_by=(open_lots.c.buy_date,open_lots.c.buy_transaction_id)).label('n')). \
+            subquery('ranked_lots')
+    # The ids RETURNING gave back are consecutive unless something else (a trigger,
+    # another writer on a database with shared sequences) inserted rows in between
+    consecutive = sell_ids[-1]-sell_ids[0]+1==len(sell_ids)
+    if consecutive:
+        # The n-th sell is sell_ids[0]+n-1.  SQLite would join the two ROW_NUMBER
+        # lists below with a nested loop, O(len(dates)**2).
+        matches = select(ranked_lots.c.buy_transaction_id,
+                         (ranked_lots.c.n+(sell_ids[0]-1)).label('sell_transaction_id')). \
+                subquery('matches')
+    else:
+        # Rows inserted in between are skipped as long as they are not sells of this account
+        ranked_sells = select(transaction_table.c.transaction_id,
+                              func.row_number().over(order_by=transaction_table.c.transaction_id).label('n')). \
+                where(transaction_table.c.transaction_id.between(sell_ids[0],sell_ids[-1])). \
+                where(transaction_table.c.type == sell_type). \
+                where(transaction_table.c.account == account). \
+                subquery('ranked_sells')
+        matches = select(ranked_lots.c.buy_transaction_id,ranked_sells.c.transaction_id.label('sell_transaction_id')). \
+                join_from(ranked_lots,ranked_sells,onclause=ranked_lots.c.n==ranked_sells.c.n). \
+                subquery('matches')
+    connection.execute(update(lot_table).
+                       where(lot_table.c.buy_transaction_id == matches.c.buy_transaction_id).
+                       values(sell_transaction_id=matches.c.sell_transaction_id))
+    return sell_ids
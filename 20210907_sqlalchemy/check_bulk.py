@@ -0,0 +1,85 @@
+'''
+Check bulk_buy and bulk_sell against a FIFO replay of the trades.
+
+Random buys and sells are loaded into a fresh in-memory database, batch by
+batch, and stress_writers.check_fifo replays them in transaction_id order.
+The check runs twice:
+
+    plain        -- the sells of a batch get consecutive ids, so bulk_sell
+                    takes its fast path
+    interleaved  -- a trigger inserts a buy in another account, and its lot,
+                    after every sell, so the ids of a batch have gaps and
+                    bulk_sell falls back to the ROW_NUMBER join
+
+To run:
+    python check_bulk.py
+'''
+
+import datetime
+import random
+import sys
+
+from sqlalchemy import create_engine
+
+import bulk
+from example4 import Base
+from stress_writers import check_fifo
+
+
+START_DATE = datetime.date(2021,1,1)
+
+INTERLEAVE_TRIGGER = '''
+CREATE TRIGGER interleave AFTER INSERT ON "transaction"
+WHEN NEW.type = 'sell_transaction' AND NEW.account != 'other'
+BEGIN
+    INSERT INTO "transaction" (date, type, account) VALUES (NEW.date, 'buy_transaction', 'other');
+    INSERT INTO lot (buy_transaction_id, account, buy_date) VALUES (last_insert_rowid(), 'other', NEW.date);
+END
+'''
+
+
+def load(engine,accounts,nbatches,seed=0):
+    '''Random batches of bulk_buy and bulk_sell; returns how many sell batches had gaps in their ids'''
+    rng = random.Random(seed)
+    held = {account:0 for account in accounts}
+    gaps = 0
+    with engine.begin() as connection:
+        for k in range(nbatches):
+            account = rng.choice(accounts)
+            n = rng.randrange(1,50)
+            dates = [START_DATE+datetime.timedelta(days=rng.randrange(365)) for j in range(n)]
+            if held[account]>=n and rng.random()<.5:
+                sell_ids = bulk.bulk_sell(connection,dates,account)
+                gaps += sell_ids[-1]-sell_ids[0]+1!=len(sell_ids)
+                held[account] -= n
+            else:
+                bulk.bulk_buy(connection,dates,account)
+                held[account] += n
+    return gaps
+
+
+def check(interleave):
+    engine = create_engine('sqlite+pysqlite://')
+    Base.metadata.create_all(engine)
+    if interleave:
+        with engine.begin() as connection:
+            connection.exec_driver_sql(INTERLEAVE_TRIGGER)
+    gaps = load(engine,['A','B','C'],200)
+    mismatches = check_fifo(engine)
+    engine.dispose()
+    return (gaps,mismatches)
+
+
+def main():
+    failed = False
+    for name,interleave in (('plain',False),('interleaved',True)):
+        gaps,mismatches = check(interleave)
+        ok = mismatches==0 and (gaps>0)==interleave
+        failed |= not ok
+        print('{:>12}: {} sell batches with gaps in their ids, {} lots wrong: {}'.format(
+            name,gaps,mismatches,'ok' if ok else 'FAILED'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
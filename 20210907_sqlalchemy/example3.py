@@ -43,8 +43,9 @@ def after_insert(mapper,connection,instance):
     qstmt = select(lot_table.c.buy_transaction_id). \
             where(lot_table.c.sell_transaction_id == None). \
             join_from(lot_table,buy_transaction_table). \
-            order_by(buy_transaction_table.c.transaction_date) 
- 
+            order_by(buy_transaction_table.c.transaction_date). \
+            limit(1)
+
     res = connection.execute(qstmt).first()
     update_stmt = update(lot_table).where(lot_table.c.buy_transaction_id == res[0]). \
             values(sell_transaction_id=instance.sell_transaction_id)
@@ -73,24 +74,25 @@ class Lot(Base):
 
 
 
-engine = create_engine('sqlite+pysqlite:///:memory:')
-Base.metadata.create_all(engine)
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+if __name__ == '__main__':
+    engine = create_engine('sqlite+pysqlite:///:memory:')
+    Base.metadata.create_all(engine)
+    DBSession = sessionmaker(bind=engine)
+    session = DBSession()
 
-import datetime
-b = BuyTransaction(transaction_date=datetime.date(2021,9,1))
-s = SellTransaction()
-l = b.purchased_lot
+    import datetime
+    b = BuyTransaction(transaction_date=datetime.date(2021,9,1))
+    s = SellTransaction()
+    l = b.purchased_lot
 
-print('\n\nb: ',b,'\n')
-print('s: ',s,'\n')
-print('l: ',l,'\n')
+    print('\n\nb: ',b,'\n')
+    print('s: ',s,'\n')
+    print('l: ',l,'\n')
 
-print('\n==================ADDING AND COMMITTING TO DATABASE===============\n')
-session.add_all([b,s])
-session.commit()
+    print('\n==================ADDING AND COMMITTING TO DATABASE===============\n')
+    session.add_all([b,s])
+    session.commit()
 
-l = b.purchased_lot
+    l = b.purchased_lot
 
-print('l: ',l,'\n')
+    print('l: ',l,'\n')
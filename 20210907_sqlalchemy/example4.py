@@ -1,11 +1,14 @@
-from sqlalchemy import Column, ForeignKey, Integer, Date, String
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy import Column, ForeignKey, Integer, Date, String, Index
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker, object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy import create_engine
 from sqlalchemy import event
-from sqlalchemy import select, update 
+from sqlalchemy import inspect, select, update
 
 Base = declarative_base()
 
+DEFAULT_ACCOUNT = 'default'
+
 '''
 Last step:  buy transaction and sell transaction are subclasses of transaction. i
 
@@ -18,6 +21,8 @@ class Transaction(Base):
     transaction_id = Column(Integer, primary_key=True)
     date = Column(Date,nullable=False)
     type = Column(String(20))
+    # Lots are matched FIFO within an account
+    account = Column(String(20),nullable=False,default=DEFAULT_ACCOUNT)
 
     # 
     __mapper_args__ = {
@@ -37,7 +42,12 @@ class BuyTransaction(Transaction):
 @event.listens_for(BuyTransaction, "after_insert")
 def after_insert(mapper,connection,instance):
     connection.execute(instance.metadata.tables['lot'].insert(),
-                       {"buy_transaction_id":instance.transaction_id})
+                       {"buy_transaction_id":instance.transaction_id,
+                        "account":instance.account,
+                        "buy_date":instance.date})
+    queue = _open_lot_queue(instance)
+    if queue is not None:
+        queue.push(instance.account,instance.date,instance.transaction_id)
 
 class SellTransaction(Transaction):
     
@@ -51,25 +61,72 @@ class SellTransaction(Transaction):
 
 @event.listens_for(SellTransaction, "after_insert")
 def after_insert(mapper,connection,instance):
-    # Find the earliest Lot with no SellTransaction
-    tables = instance.metadata.tables
-    lot_table = tables['lot']
-    transaction_table = tables['transaction']
-    
-    '''
-    sqlalchemy.exc.AmbiguousForeignKeysError: Can't determine join between 'lot' and 'transaction'; tables have more than one foreign key constraint relationship between them. Please specify the 'onclause' of this join explicitly.
-    '''
-
-    qstmt = select(lot_table.c.buy_transaction_id). \
-            where(lot_table.c.sell_transaction_id == None). \
-            join_from(lot_table,transaction_table,
-                      onclause=lot_table.c.buy_transaction_id==transaction_table.c.transaction_id). \
-            order_by(transaction_table.c.date) 
-    res = connection.execute(qstmt).first()
-    update_stmt = update(lot_table).where(lot_table.c.buy_transaction_id == res[0]). \
+    # Find the earliest Lot in the account with no SellTransaction
+    lot_table = instance.metadata.tables['lot']
+
+    queue = _open_lot_queue(instance)
+    if queue is not None:
+        buy_transaction_id = queue.pop(connection,instance.account)
+    else:
+        # Lot keeps a copy of the buy date, so this is one lookup in ix_lot_open rather than a join and sort
+        qstmt = select(lot_table.c.buy_transaction_id). \
+                where(lot_table.c.account == instance.account). \
+                where(lot_table.c.sell_transaction_id == None). \
+                order_by(lot_table.c.buy_date,lot_table.c.buy_transaction_id). \
+                limit(1)
+        buy_transaction_id = connection.execute(qstmt).scalar()
+    if buy_transaction_id is None:
+        raise ValueError('No open Lot in account {} for sell transaction {}'.format(instance.account,instance.transaction_id))
+    update_stmt = update(lot_table).where(lot_table.c.buy_transaction_id == buy_transaction_id). \
             values(sell_transaction_id=instance.transaction_id)
     connection.execute(update_stmt)
 
+# Lot.account and Lot.buy_date copy the buy transaction.  Changing the date or
+# account of a buy moves its lot if the lot is still open; once the lot is
+# sold the FIFO match depends on them, so they can no longer change, and
+# neither can the account of a sell.  Bulk UPDATEs bypass these listeners.
+@event.listens_for(BuyTransaction, "before_update")
+def before_update(mapper,connection,instance):
+    if not _changed(instance,'date','account'):
+        return
+    lot_table = instance.metadata.tables['lot']
+    sell_transaction_id = connection.execute(select(lot_table.c.sell_transaction_id).
+                                             where(lot_table.c.buy_transaction_id == instance.transaction_id)).scalar()
+    if sell_transaction_id is not None:
+        raise ValueError('Buy transaction {} has been sold by {}, its date and account cannot change'.format(
+            instance.transaction_id,sell_transaction_id))
+
+@event.listens_for(BuyTransaction, "after_update")
+def after_update(mapper,connection,instance):
+    if not _changed(instance,'date','account'):
+        return
+    lot_table = instance.metadata.tables['lot']
+    connection.execute(update(lot_table).where(lot_table.c.buy_transaction_id == instance.transaction_id).
+                       values(account=instance.account,buy_date=instance.date))
+    # A Lot already loaded in the session sees the new values without a refresh
+    lot = instance.__dict__.get('purchased_lot')
+    if lot is not None:
+        set_committed_value(lot,'account',instance.account)
+        set_committed_value(lot,'buy_date',instance.date)
+    queue = _open_lot_queue(instance)
+    if queue is not None:
+        queue.invalidate()
+
+@event.listens_for(SellTransaction, "before_update")
+def before_update(mapper,connection,instance):
+    if _changed(instance,'account'):
+        raise ValueError('Sell transaction {} has been matched to a lot, its account cannot change'.format(
+            instance.transaction_id))
+
+def _changed(instance,*keys):
+    attrs = inspect(instance).attrs
+    return any(attrs[key].history.has_changes() for key in keys)
+
+def _open_lot_queue(instance):
+    # In-process queue of open lots, see open_lot_queue.py
+    session = object_session(instance)
+    return session.info.get('open_lot_queue') if session is not None else None
+
 ''' Lot is like an edge connecting two transactions'''
 class Lot(Base):
     __tablename__ = 'lot'
@@ -83,6 +140,17 @@ class Lot(Base):
     sell_transaction_id = Column(Integer,
                                  ForeignKey('transaction.transaction_id'))
 
+    # Copies of buy_transaction.account and date, so open lots can be indexed in FIFO order
+    account = Column(String(20),nullable=False,default=DEFAULT_ACCOUNT)
+    buy_date = Column(Date,nullable=False)
+
+    __table_args__ = (
+        Index('ix_lot_open',account,buy_date,buy_transaction_id,
+              sqlite_where=sell_transaction_id == None),
+        # For SellTransaction.sold_lot; leaving out open lots keeps the FIFO lookup on ix_lot_open
+        Index('ix_lot_sell_transaction_id',sell_transaction_id,
+              sqlite_where=sell_transaction_id != None),
+    )
 
 
     buy_transaction = relationship(BuyTransaction,
@@ -98,24 +166,25 @@ class Lot(Base):
 
 
 
-engine = create_engine('sqlite+pysqlite:///:memory:')
-Base.metadata.create_all(engine)
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+if __name__ == '__main__':
+    engine = create_engine('sqlite+pysqlite:///:memory:')
+    Base.metadata.create_all(engine)
+    DBSession = sessionmaker(bind=engine)
+    session = DBSession()
 
-import datetime
-b = BuyTransaction(date=datetime.date(2021,9,1))
-s = SellTransaction(date=datetime.date(2021,9,8))
-l = b.purchased_lot
+    import datetime
+    b = BuyTransaction(date=datetime.date(2021,9,1))
+    s = SellTransaction(date=datetime.date(2021,9,8))
+    l = b.purchased_lot
 
-print('\n\nb: ',b,'\n')
-print('s: ',s,'\n')
-print('l: ',l,'\n')
+    print('\n\nb: ',b,'\n')
+    print('s: ',s,'\n')
+    print('l: ',l,'\n')
 
-print('\n==================ADDING AND COMMITTING TO DATABASE===============\n')
-session.add_all([b,s])
-session.commit()
+    print('\n==================ADDING AND COMMITTING TO DATABASE===============\n')
+    session.add_all([b,s])
+    session.commit()
 
-l = b.purchased_lot
+    l = b.purchased_lot
 
-print('l: ',l,'\n')
+    print('l: ',l,'\n')
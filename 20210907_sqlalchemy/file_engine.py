@@ -0,0 +1,100 @@
+'''
+File backed SQLite engine for ingesting from several writer processes.
+
+The examples use an in-memory database with one session.  For several
+processes writing to one database file:
+
+    - journal_mode=WAL, so readers do not block the writer or each other
+    - every transaction starts with BEGIN IMMEDIATE, which takes the write
+      lock up front.  The FIFO lookup for a sell and its UPDATE then run with
+      no other writer in between, so lot matching is serialized per account.
+      (SQLite has one write lock per file, so writers to different accounts
+      take turns too; WAL keeps each turn short.)
+    - a writer waits up to busy_timeout seconds for the lock; if that runs
+      out, run_transaction rolls back and retries with backoff
+    - each process has its own pool of connections (QueuePool)
+
+Example:
+    from sqlalchemy.orm import sessionmaker
+    from example4 import Base, BuyTransaction
+    from file_engine import create_file_engine, run_transaction
+
+    engine = create_file_engine('lots.db')
+    Base.metadata.create_all(engine)
+    DBSession = sessionmaker(bind=engine)
+    run_transaction(DBSession,lambda session: session.add(BuyTransaction(date=d,account='A')))
+'''
+
+import random
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+
+
+def create_file_engine(path,pool_size=5,max_overflow=10,busy_timeout=30.):
+    '''Engine for the SQLite database file at path, set up for concurrent writers
+
+    Inputs:
+        path -- database file
+        pool_size, max_overflow -- connections kept open, and extra ones allowed
+        busy_timeout -- seconds to wait for the write lock
+
+    Returns:
+        SQLAlchemy Engine.  Create it in the process that uses it; after a
+        fork, call engine.dispose(close=False) in the child.
+    '''
+    engine = create_engine('sqlite+pysqlite:///'+path,
+                           pool_size=pool_size,max_overflow=max_overflow,
+                           connect_args={'timeout':busy_timeout})
+    configure_sqlite(engine,busy_timeout)
+    return engine
+
+
+def configure_sqlite(engine,busy_timeout=30.):
+    '''Add the WAL, busy timeout and BEGIN IMMEDIATE set up to a SQLite engine
+
+    Also used for the sync_engine of the aiosqlite engine in async_lots.py.
+    '''
+    @event.listens_for(engine,'connect')
+    def connect(dbapi_connection,connection_record):
+        # Stop the driver from issuing its own deferred BEGIN, see begin below
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout={:d}'.format(int(1000*busy_timeout)))
+        cursor.close()
+
+    @event.listens_for(engine,'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def is_locked_error(exc):
+    '''True for the OperationalError SQLite raises when the busy timeout runs out'''
+    return isinstance(exc,OperationalError) and \
+        any(msg in str(exc.orig) for msg in ('database is locked','database is busy'))
+
+
+def run_transaction(DBSession,fcn,retries=10,backoff=.05):
+    '''Call fcn(session) in a transaction, retrying if the database is locked
+
+    Inputs:
+        DBSession -- sessionmaker bound to a create_file_engine engine
+        fcn -- function of a session; it runs again on each retry, so it
+               should only touch the database through that session
+        retries -- attempts after the first one
+        backoff -- seconds to wait before the first retry, doubled on each retry
+
+    Returns:
+        (value returned by fcn, number of retries)
+    '''
+    for attempt in range(retries+1):
+        try:
+            with DBSession.begin() as session:
+                return (fcn(session),attempt)
+        except OperationalError as exc:
+            if not is_locked_error(exc) or attempt==retries:
+                raise
+            time.sleep(backoff*2**attempt*random.uniform(.5,1.5))
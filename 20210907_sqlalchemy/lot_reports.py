@@ -0,0 +1,123 @@
+'''
+Lot reports for the example4 model, without a query per lot.
+
+Lot.buy_transaction and Lot.sell_transaction load lazily, so printing a list
+of lots runs two more SELECTs for each one.  The reports here load the
+transactions with the lots and stream the results in chunks of yield_per
+rows:
+
+    open_lots, closed_lots -- Lot objects, transactions joined eagerly; the
+                              session only holds on to the lots you keep
+    realized_lots -- rows of buy and sell ids and dates, and the holding period in days
+    holding_period_report -- number of lots and holding periods by account
+    export_lots_csv -- every lot as a CSV row, from a Core select that never
+                       creates ORM objects, for exports of millions of lots
+
+The row reports join lot to an alias of transaction for the sell date, and
+use Lot.buy_date for the buy date.
+
+Example:
+    from lot_reports import closed_lots, export_lots_csv
+
+    for lot in closed_lots(session,account='A'):
+        print(lot)
+    export_lots_csv(session.connection(),'lots.csv')
+'''
+
+import csv
+
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import aliased, joinedload
+
+from example4 import Lot, Transaction
+
+
+YIELD_PER = 1000
+CSV_COLUMNS = ['account','buy_transaction_id','buy_date','sell_transaction_id','sell_date','holding_days']
+
+
+def open_lots(session,account=None,yield_per=YIELD_PER):
+    '''Iterate over the lots with no sell, in FIFO order, with their buy transactions loaded'''
+    stmt = select(Lot). \
+            options(joinedload(Lot.buy_transaction,innerjoin=True)). \
+            where(Lot.sell_transaction_id == None). \
+            order_by(Lot.account,Lot.buy_date,Lot.buy_transaction_id)
+    if account is not None:
+        stmt = stmt.where(Lot.account == account)
+    return session.scalars(stmt.execution_options(yield_per=yield_per))
+
+
+def closed_lots(session,account=None,yield_per=YIELD_PER):
+    '''Iterate over the sold lots, in order of sale, with both transactions loaded'''
+    stmt = select(Lot). \
+            options(joinedload(Lot.buy_transaction,innerjoin=True),
+                    joinedload(Lot.sell_transaction,innerjoin=True)). \
+            where(Lot.sell_transaction_id != None). \
+            order_by(Lot.sell_transaction_id)
+    if account is not None:
+        stmt = stmt.where(Lot.account == account)
+    return session.scalars(stmt.execution_options(yield_per=yield_per))
+
+
+def _lot_rows(closed_only=False,account=None):
+    # Lot has the buy date, the sell date comes from transaction (outer joined for open lots)
+    sell = aliased(Transaction.__table__,name='sell')
+    lot_table = Lot.__table__
+    holding_days = func.julianday(sell.c.date)-func.julianday(lot_table.c.buy_date)
+    stmt = select(lot_table.c.account,
+                  lot_table.c.buy_transaction_id,lot_table.c.buy_date,
+                  lot_table.c.sell_transaction_id,sell.c.date.label('sell_date'),
+                  cast(holding_days,Integer).label('holding_days')). \
+            join_from(lot_table,sell,lot_table.c.sell_transaction_id == sell.c.transaction_id,isouter=not closed_only)
+    if account is not None:
+        stmt = stmt.where(lot_table.c.account == account)
+    return stmt
+
+
+def realized_lots(connection,account=None,yield_per=YIELD_PER):
+    '''Iterate over rows of the sold lots, in order of sale
+
+    Rows have the fields of CSV_COLUMNS; holding_days is the number of days
+    from buy to sell.
+    '''
+    stmt = _lot_rows(closed_only=True,account=account).order_by(Lot.__table__.c.sell_transaction_id)
+    return connection.execute(stmt.execution_options(yield_per=yield_per))
+
+
+def holding_period_report(connection,account=None):
+    '''Number of open and sold lots and the holding periods of the sold lots, by account
+
+    Returns:
+        list of rows (account, open_lots, closed_lots, mean_days, min_days, max_days)
+    '''
+    rows = _lot_rows(account=account).subquery('lots')
+    stmt = select(rows.c.account,
+                  func.count().filter(rows.c.sell_transaction_id == None).label('open_lots'),
+                  func.count(rows.c.sell_transaction_id).label('closed_lots'),
+                  func.avg(rows.c.holding_days).label('mean_days'),
+                  func.min(rows.c.holding_days).label('min_days'),
+                  func.max(rows.c.holding_days).label('max_days')). \
+            group_by(rows.c.account). \
+            order_by(rows.c.account)
+    return connection.execute(stmt).all()
+
+
+def export_lots_csv(connection,path,account=None,yield_per=10000):
+    '''Write every lot (open ones with empty sell fields) to a CSV file
+
+    Rows are streamed from the database yield_per at a time, so memory
+    does not grow with the number of lots.
+
+    Returns:
+        number of lots written
+    '''
+    stmt = _lot_rows(account=account).order_by(Lot.__table__.c.buy_transaction_id)
+    result = connection.execute(stmt.execution_options(yield_per=yield_per))
+    nrows = 0
+    with open(path,'w',newline='') as fid:
+        writer = csv.writer(fid)
+        writer.writerow(CSV_COLUMNS)
+        for rows in result.partitions():
+            writer.writerows(rows)
+            nrows += len(rows)
+    return nrows
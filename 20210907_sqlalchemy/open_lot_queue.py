@@ -0,0 +1,84 @@
+'''
+In-process priority queue of open Lots for the example4 model.
+
+With a queue attached to a session, the SellTransaction listener pops the
+oldest open lot of its account from a heap of (buy_date, buy_transaction_id)
+instead of querying for it, and the BuyTransaction listener pushes each new
+lot onto the heap of its account.  The queue is loaded from the database on
+first use and again after a rollback, since a rollback can undo lots that
+were pushed or popped.
+
+Example:
+    from open_lot_queue import attach_open_lot_queue
+
+    session = DBSession()
+    attach_open_lot_queue(session)
+    session.add_all([BuyTransaction(date=d1),SellTransaction(date=d2)])
+    session.commit()
+
+Lots changed behind the session's back (e.g. by bulk.bulk_sell) are not
+seen by the queue; call invalidate() afterwards.  With several writers on one
+database file (see file_engine.py) a queue is only correct if no other
+process writes to the same accounts.
+'''
+
+import heapq
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from example4 import Lot
+
+
+class OpenLotQueue:
+    '''Heaps of (buy_date, buy_transaction_id) of the lots with no sell, by account'''
+
+    def __init__(self):
+        self._heaps = {}
+        self.stale = True
+
+    def __len__(self):
+        return sum(len(heap) for heap in self._heaps.values())
+
+    def invalidate(self):
+        self._heaps = {}
+        self.stale = True
+
+    def load(self,connection):
+        lot_table = Lot.__table__
+        rows = connection.execute(select(lot_table.c.account,lot_table.c.buy_date,lot_table.c.buy_transaction_id).
+                                  where(lot_table.c.sell_transaction_id == None))
+        self._heaps = {}
+        for account,buy_date,buy_transaction_id in rows:
+            self._heaps.setdefault(account,[]).append((buy_date,buy_transaction_id))
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+        self.stale = False
+
+    def push(self,account,buy_date,buy_transaction_id):
+        # A stale queue picks up the new lot when it is loaded
+        if not self.stale:
+            heapq.heappush(self._heaps.setdefault(account,[]),(buy_date,buy_transaction_id))
+
+    def pop(self,connection,account):
+        '''buy_transaction_id of the oldest open lot in account, or None if there is none'''
+        if self.stale:
+            self.load(connection)
+        heap = self._heaps.get(account)
+        if not heap:
+            return None
+        return heapq.heappop(heap)[1]
+
+
+def attach_open_lot_queue(session):
+    '''Use an OpenLotQueue for the FIFO matching of sells in session'''
+    queue = OpenLotQueue()
+    session.info['open_lot_queue'] = queue
+    return queue
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def after_soft_rollback(session,previous_transaction):
+    queue = session.info.get('open_lot_queue')
+    if queue is not None:
+        queue.invalidate()
@@ -0,0 +1,127 @@
+'''
+Stress test of concurrent ingestion into a file backed SQLite database.
+
+For each number of writers, a fresh database file is created and that many
+processes ingest random buys and sells through the ORM listeners, in
+transactions of --batch trades.  Every writer trades in all of the accounts,
+so sells in one account race each other across processes.  A writer only
+sells in an account as many lots as it has bought there, so every sell
+finds an open lot.
+
+Afterwards the FIFO assignment is checked by replaying every account's
+trades in transaction_id (commit) order.
+
+To run:
+    python stress_writers.py
+    python stress_writers.py --writers 1 4 8 --trades 5000 --batch 50 --accounts 32
+'''
+
+import argparse
+import datetime
+import heapq
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from example4 import Base, BuyTransaction, Lot, SellTransaction, Transaction
+from file_engine import create_file_engine, run_transaction
+
+
+START_DATE = datetime.date(2021,1,1)
+
+
+def writer(job):
+    path,seed,ntrades,batch,accounts = job
+    rng = random.Random(seed)
+    engine = create_file_engine(path)
+    DBSession = sessionmaker(bind=engine)
+
+    # Lots this writer bought and has not sold, by account
+    held = dict.fromkeys(accounts,0)
+    retries = 0
+    t0 = time.perf_counter()
+    for start in range(0,ntrades,batch):
+        trades = []
+        for k in range(start,min(start+batch,ntrades)):
+            account = rng.choice(accounts)
+            date = START_DATE+datetime.timedelta(days=rng.randrange(365))
+            if held[account] and rng.random()<.45:
+                held[account] -= 1
+                trades.append(SellTransaction(date=date,account=account))
+            else:
+                held[account] += 1
+                trades.append(BuyTransaction(date=date,account=account))
+        retries += run_transaction(DBSession,lambda session: session.add_all(trades))[1]
+    seconds = time.perf_counter()-t0
+    engine.dispose()
+    return (ntrades,retries,seconds)
+
+
+def check_fifo(engine):
+    '''Number of lots whose sell differs from a replay of the trades in id order'''
+    transaction_table = Transaction.__table__
+    lot_table = Lot.__table__
+    heaps = {}
+    expected = {}
+    with engine.connect() as connection:
+        for transaction_id,date,type,account in connection.execute(
+                select(transaction_table.c.transaction_id,transaction_table.c.date,
+                       transaction_table.c.type,transaction_table.c.account).
+                order_by(transaction_table.c.transaction_id)):
+            heap = heaps.setdefault(account,[])
+            if type=='buy_transaction':
+                heapq.heappush(heap,(date,transaction_id))
+                expected[transaction_id] = None
+            else:
+                expected[heapq.heappop(heap)[1]] = transaction_id
+        actual = dict(connection.execute(select(lot_table.c.buy_transaction_id,lot_table.c.sell_transaction_id)).all())
+    return sum(actual.get(k,-1)!=v for k,v in expected.items())+len(set(actual)-set(expected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers',type=int,nargs='+',default=[1,4,8])
+    parser.add_argument('--trades',type=int,default=2000,help='trades per writer')
+    parser.add_argument('--batch',type=int,default=20,help='trades per transaction')
+    parser.add_argument('--accounts',type=int,default=16)
+    parser.add_argument('--dir',help='directory for the database files (default: a temporary directory)')
+    args = parser.parse_args()
+
+    tmpdir = args.dir or tempfile.mkdtemp()
+    accounts = ['ACCT{:03d}'.format(k) for k in range(args.accounts)]
+    print('{:>7} {:>8} {:>9} {:>10} {:>8} {:>10}'.format('writers','trades','seconds','trades/s','retries','fifo'))
+    try:
+        for nwriters in args.writers:
+            path = os.path.join(tmpdir,'stress_{}.db'.format(nwriters))
+            for suffix in ('','-wal','-shm'):
+                if os.path.exists(path+suffix):
+                    os.remove(path+suffix)
+            engine = create_file_engine(path)
+            Base.metadata.create_all(engine)
+
+            jobs = [(path,seed,args.trades,args.batch,accounts) for seed in range(nwriters)]
+            t0 = time.perf_counter()
+            with multiprocessing.Pool(nwriters) as pool:
+                results = pool.map(writer,jobs)
+            seconds = time.perf_counter()-t0
+
+            ntrades = sum(r[0] for r in results)
+            retries = sum(r[1] for r in results)
+            mismatches = check_fifo(engine)
+            engine.dispose()
+            print('{:>7} {:>8} {:9.2f} {:10.0f} {:>8} {:>10}'.format(
+                nwriters,ntrades,seconds,ntrades/seconds,retries,
+                'ok' if mismatches==0 else '{} wrong'.format(mismatches)))
+    finally:
+        if not args.dir:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()